@@ -1,19 +1,35 @@
+import asyncio
+import contextvars
 import datetime
-import operator
+import json
+import math
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from html import escape
 from typing import Annotated, TypedDict
 
-from dotenv import load_dotenv
-from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import END, StateGraph
-from mailersend import emails
+from langgraph.graph.message import add_messages
 
+from agents.checkpointer import make_checkpointer
+from agents.config import env_bool, env_float, env_int
+from agents.context import CONTEXT_MAX_TOKENS, SUMMARY_PROMPT, compact, estimate_tokens, estimate_text
+from agents.email_queue import get_email_queue
+from agents.email_render import render_plan_html
+from agents.llm import get_llm
+from agents.llm_cache import LLM_CACHE, LLMResponseCache
+from agents.metrics import METRICS, METRICS_PORT, current_thread_id, llm_usage
+from agents.prefetch import PREFETCH_ENABLED, Prefetcher
+from agents.quota import QUOTA
+from agents.ratelimit import OPENAI_LIMITER
+from agents.tools import serpapi_client
 from agents.tools.flights_finder import flights_finder
 from agents.tools.hotels_finder import hotels_finder
-
-_ = load_dotenv()
+from agents.tools.trip_search import trip_search
 
 CURRENT_YEAR = datetime.datetime.now().year
 
@@ -27,91 +43,532 @@ TOOLS_SYSTEM_PROMPT = f"""You are a smart travel agency. Use the tools to look u
     In your output always include the price of the flight and the price of the hotel and the currency as well (if possible).
     """
 
+FINAL_ANSWER_PROMPT = """The search budget for this request is used up and no more tools can be called.
+Write the best travel plan you can from the information gathered above, and say briefly what could not be looked up.
+"""
+
 EMAILS_SYSTEM_PROMPT = """Your task is to convert structured markdown-like text into a valid HTML email body.
 Do not include a ```html preamble in your response.
 The output should be in proper HTML format, ready to be used as the body of an email.
 """
 
-TOOLS = [flights_finder, hotels_finder]
+TOOLS = [flights_finder, hotels_finder, trip_search]
+
+TOOL_PROGRESS = {
+    'flights_finder': 'Searching flights…',
+    'hotels_finder': 'Searching hotels…',
+    'trip_search': 'Comparing dates and airports…'
+}
+
+# Maximum number of tool calls from a single model turn that run at the same time.
+TOOLS_MAX_FANOUT = env_int('TOOLS_MAX_FANOUT', 4)
+# Seconds a single tool call may run before its result is replaced by a timeout error.
+TOOL_CALL_TIMEOUT = env_float('TOOL_CALL_TIMEOUT', 30.0)
+# Use gpt-4o to convert plans the local markdown renderer cannot handle.
+EMAIL_LLM_FALLBACK = env_bool('EMAIL_LLM_FALLBACK', True)
+# Per-run budgets of the tools loop, 0 for unlimited. A run can override them with the
+# max_iterations, deadline, max_tokens and max_serpapi_calls keys of its configurable.
+RUN_MAX_ITERATIONS = env_int('RUN_MAX_ITERATIONS', 8)
+RUN_DEADLINE = env_float('RUN_DEADLINE', 120.0)
+RUN_MAX_TOKENS = env_int('RUN_MAX_TOKENS', 60000)
+RUN_MAX_SERPAPI_CALLS = env_int('RUN_MAX_SERPAPI_CALLS', 20)
+
+def tool_content(result) -> str:
+    # Compact JSON instead of repr(): fewer tokens on every round-trip the message is re-sent.
+    if isinstance(result, str):
+        return result
+    return json.dumps(result, separators=(',', ':'), ensure_ascii=False, default=str)
+
+def model_turns(messages) -> int:
+    '''Number of model responses since the last human message, i.e. the loop iteration.'''
+    turns = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        turns += isinstance(message, AIMessage)
+    return turns
+
+def exhausted_budget(budget) -> str:
+    '''Name of the first budget the run has used up, or None.'''
+    if not budget:
+        return None
+    limits = budget['limits']
+    if limits['max_iterations'] and budget['iterations'] >= limits['max_iterations']:
+        return 'iterations'
+    if limits['deadline'] and time.time() - budget['started_at'] >= limits['deadline']:
+        return 'deadline'
+    if limits['max_tokens'] and budget['tokens'] >= limits['max_tokens']:
+        return 'tokens'
+    if limits['max_serpapi_calls'] and budget['serpapi_calls'] >= limits['max_serpapi_calls']:
+        return 'serpapi_calls'
+    return None
 
 class AgentState(TypedDict):
-    messages: Annotated[list[AnyMessage], operator.add]
+    # add_messages lets the context compaction replace and remove messages by id.
+    messages: Annotated[list[AnyMessage], add_messages]
+    # Rolling summary of the turns compacted out of messages.
+    summary: str
+    # Usage and limits of the current run, reset by every new human message.
+    budget: dict
 
 class Agent:
-    def __init__(self):
+    def __init__(self, checkpointer=None, tools_llm=None, email_llm=None, email_queue=None, prefetcher=None,
+                 llm_cache=None):
         self._tools = {t.name: t for t in TOOLS}
-        self._tools_llm = ChatOpenAI(model='gpt-3.5-turbo').bind_tools(TOOLS)
+        # Searches guessed from the query start while the first model call is running.
+        self._prefetcher = prefetcher or (Prefetcher(self._tools) if PREFETCH_ENABLED else None)
+        # streaming=True lets stream_mode='messages' forward the plan token by token.
+        tools_llm = tools_llm or get_llm('gpt-3.5-turbo', streaming=True, stream_usage=True)
+        self._tools_llm = tools_llm.bind_tools(TOOLS)
+        # The forced final answer uses the same model without tools.
+        self._final_llm = tools_llm
+        self._tools_model = getattr(tools_llm, 'model_name', type(tools_llm).__name__)
+        self._llm_cache = llm_cache or (LLMResponseCache(self._tools_model, TOOLS) if LLM_CACHE else None)
+        self._email_llm = email_llm or get_llm('gpt-4o', temperature=0.1)
+        self._email_model = getattr(self._email_llm, 'model_name', type(self._email_llm).__name__)
+        self._email_queue = email_queue or get_email_queue()
 
         builder = StateGraph(AgentState)
-        builder.add_node('call_tools_llm', self.call_tools_llm)
-        builder.add_node('invoke_tools', self.invoke_tools)
-        builder.add_node('email_sender', self.email_sender)
-        builder.set_entry_point('call_tools_llm')
+        # Each node has a sync and an async implementation so the graph can be driven
+        # with invoke/stream as well as ainvoke/astream.
+        builder.add_node('compact_context', self._node('compact_context', self.compact_context, self.acompact_context))
+        builder.add_node('call_tools_llm', self._node('call_tools_llm', self.call_tools_llm, self.acall_tools_llm))
+        builder.add_node('invoke_tools', self._node('invoke_tools', self.invoke_tools, self.ainvoke_tools))
+        builder.add_node('final_answer', self._node('final_answer', self.final_answer, self.afinal_answer))
+        builder.add_node('email_sender', self._node('email_sender', self.email_sender, self.aemail_sender))
+        builder.set_entry_point('compact_context')
+        builder.add_edge('compact_context', 'call_tools_llm')
 
         builder.add_conditional_edges('call_tools_llm', Agent.exists_action, 
-            {'more_tools': 'invoke_tools', 'email_sender': 'email_sender'}
+            {'more_tools': 'invoke_tools', 'email_sender': 'email_sender', 'final_answer': 'final_answer'}
+        )
+        builder.add_conditional_edges('invoke_tools', Agent.within_budget,
+            {'compact_context': 'compact_context', 'final_answer': 'final_answer'}
         )
-        builder.add_edge('invoke_tools', 'call_tools_llm')
+        builder.add_edge('final_answer', 'email_sender')
         builder.add_edge('email_sender', END)
-        memory = MemorySaver()
+        memory = checkpointer or make_checkpointer()
         self.graph = builder.compile(checkpointer=memory, interrupt_before=['email_sender'])
 
+    @staticmethod
+    def _node(name, func, afunc):
+        '''Wrap a node so its wall time and errors are recorded against the run's thread_id.'''
+        def iteration(state):
+            return model_turns(state['messages']) + (name == 'call_tools_llm')
+
+        def run(state: AgentState, config: RunnableConfig):
+            token = current_thread_id.set(config.get('configurable', {}).get('thread_id'))
+            try:
+                with METRICS.timed('node', name, iteration=iteration(state)):
+                    return func(state, config)
+            finally:
+                current_thread_id.reset(token)
+
+        async def arun(state: AgentState, config: RunnableConfig):
+            token = current_thread_id.set(config.get('configurable', {}).get('thread_id'))
+            try:
+                with METRICS.timed('node', name, iteration=iteration(state)):
+                    return await afunc(state, config)
+            finally:
+                current_thread_id.reset(token)
+
+        return RunnableLambda(run, afunc=arun, name=name)
+
+    def stream_plan(self, inputs, config):
+        '''Run the graph and yield ('progress', label) and ('token', text) events.
+
+        Progress events are emitted when the model asks for tools and when their results
+        come back; token events carry the final answer as it is generated. A ('reset', '')
+        event tells the consumer to discard tokens streamed during a turn that turned out
+        to be a tool-calling turn. The run still stops before email_sender.
+        '''
+        for mode, chunk in self.graph.stream(inputs, config=config, stream_mode=['updates', 'messages']):
+            if mode == 'messages':
+                message, metadata = chunk
+                if metadata.get('langgraph_node') in ('call_tools_llm', 'final_answer') and message.content:
+                    yield 'token', message.content
+                continue
+            for node, update in chunk.items():
+                if node == 'call_tools_llm':
+                    tool_calls = update['messages'][-1].tool_calls
+                    if tool_calls:
+                        yield 'reset', ''
+                    for t in tool_calls:
+                        yield 'progress', TOOL_PROGRESS.get(t['name'], f"Running {t['name']}…")
+                elif node == 'invoke_tools':
+                    yield 'progress', 'Putting your travel plan together…'
+
     @staticmethod
     def exists_action(state: AgentState):
         result = state['messages'][-1]
         if len(result.tool_calls) == 0:
             return 'email_sender'
+        if exhausted_budget(state.get('budget')):
+            return 'final_answer'
         return 'more_tools'
 
-    def email_sender(self, state: AgentState):
+    @staticmethod
+    def within_budget(state: AgentState):
+        return 'final_answer' if exhausted_budget(state.get('budget')) else 'compact_context'
+
+    def _budget(self, state: AgentState, config: RunnableConfig) -> dict:
+        '''The run's budget, started afresh when the turn begins with a human message.'''
+        budget = state.get('budget')
+        if budget is None or isinstance(state['messages'][-1], HumanMessage):
+            configurable = config.get('configurable', {})
+            # Requests that finished after the previous run ended are not this run's.
+            serpapi_client.begin_run(current_thread_id.get())
+            budget = {
+                'limits': {
+                    'max_iterations': configurable.get('max_iterations', RUN_MAX_ITERATIONS),
+                    'deadline': configurable.get('deadline', RUN_DEADLINE),
+                    'max_tokens': configurable.get('max_tokens', RUN_MAX_TOKENS),
+                    'max_serpapi_calls': configurable.get('max_serpapi_calls', RUN_MAX_SERPAPI_CALLS)
+                },
+                'started_at': time.time(),
+                'iterations': 0, 'tokens': 0, 'serpapi_calls': 0, 'elapsed': 0.0, 'exhausted': None
+            }
+        else:
+            serpapi_client.begin_run(current_thread_id.get(), resume=True)
+        return dict(budget)
+
+    def _spend(self, budget: dict, message: AIMessage = None) -> dict:
+        if message is not None:
+            budget['iterations'] += 1
+            budget['tokens'] += sum(llm_usage(message).values())
+        # Upstream SerpAPI requests of this thread since the last node; cache hits are free.
+        # An answer without tool calls ends the run, and with it the counting.
+        if message is not None and not message.tool_calls:
+            budget['serpapi_calls'] += serpapi_client.end_run(current_thread_id.get())
+        else:
+            budget['serpapi_calls'] += serpapi_client.take_calls(current_thread_id.get())
+        budget['elapsed'] = round(time.time() - budget['started_at'], 3)
+        return budget
+
+    def email_sender(self, state: AgentState, config: RunnableConfig):
         print('Sending email')
-        email_llm = ChatOpenAI(model='gpt-4o', temperature=0.1)
-        email_message = [
+        envelope = self._email_envelope(config)
+        if envelope is None:
+            return
+        html = render_plan_html(state['messages'][-1].content)
+        if html is None and EMAIL_LLM_FALLBACK:
+            response = self._invoke_llm(self._email_llm, self._email_model, self._email_messages(state))
+            html = response.content
+        self._queue_email(envelope, html, state['messages'][-1].content)
+
+    async def aemail_sender(self, state: AgentState, config: RunnableConfig):
+        print('Sending email')
+        envelope = self._email_envelope(config)
+        if envelope is None:
+            return
+        html = render_plan_html(state['messages'][-1].content)
+        if html is None and EMAIL_LLM_FALLBACK:
+            response = await self._ainvoke_llm(self._email_llm, self._email_model, self._email_messages(state))
+            html = response.content
+        self._queue_email(envelope, html, state['messages'][-1].content)
+
+    @staticmethod
+    def _email_messages(state: AgentState):
+        return [
             SystemMessage(content=EMAILS_SYSTEM_PROMPT), 
             HumanMessage(content=state['messages'][-1].content)
         ]
-        email_response = email_llm.invoke(email_message)
-        print('Email content:', email_response.content)
 
-        try:
-            mailer = emails.NewEmail(os.environ.get('MAILERSEND_API_KEY'))
-            mail_body = {
-                "from": {
-                    "email": os.environ['FROM_EMAIL'],
-                    "name": "AI Travel Assistant"
-                },
-                "to": [
-                    {
-                        "email": os.environ['TO_EMAIL'],
-                        "name": "Traveler"
-                    }
-                ],
-                "subject": os.environ['EMAIL_SUBJECT'],
-                "html": email_response.content
-            }
+    @staticmethod
+    def _email_envelope(config: RunnableConfig):
+        '''Sender, recipient and subject from the config or the environment; None when one is missing.'''
+        configurable = config.get('configurable', {})
+        envelope = {
+            'from_email': configurable.get('from_email') or os.environ.get('FROM_EMAIL'),
+            'to_email': configurable.get('to_email') or os.environ.get('TO_EMAIL'),
+            'email_subject': configurable.get('email_subject') or os.environ.get('EMAIL_SUBJECT')
+        }
+        missing = [name.upper() for name, value in envelope.items() if not value]
+        if missing:
+            # The plan is already complete; only the email is skipped.
+            print(f"Error sending email: {', '.join(missing)} not set")
+            return None
+        return envelope
 
-            response = mailer.send(mail_body)
-            print("Email sent successfully")
-            print(response)
-        except Exception as e:
-            print(f"Error sending email: {str(e)}")
+    def _queue_email(self, envelope: dict, html, plan: str):
+        if html is None:
+            # Neither renderer applies: send the plan as preformatted text.
+            html = f"<pre>{escape(plan)}</pre>"
+        print('Email content:', html)
+        mail_body = {
+            "from": {
+                "email": envelope['from_email'],
+                "name": "AI Travel Assistant"
+            },
+            "to": [
+                {
+                    "email": envelope['to_email'],
+                    "name": "Traveler"
+                }
+            ],
+            "subject": envelope['email_subject'],
+            "html": html
+        }
+        # Delivery (and its retries) happens on the email queue's worker threads.
+        self._email_queue.submit(mail_body)
+
+    def compact_context(self, state: AgentState, config: RunnableConfig):
+        '''Digest old tool results and roll old turns into the summary once the history is too long.'''
+        max_tokens = config.get('configurable', {}).get('context_max_tokens', CONTEXT_MAX_TOKENS)
+        before = estimate_tokens(state['messages']) + estimate_text(state.get('summary') or '')
+        updates, summary = compact(state['messages'], state.get('summary'), max_tokens)
+        if not updates:
+            return None
+        after = estimate_tokens(add_messages(state['messages'], updates)) + estimate_text(summary)
+        print(f'Compacted context: ~{before} -> ~{after} tokens')
+        return {'messages': updates, 'summary': summary}
+
+    async def acompact_context(self, state: AgentState, config: RunnableConfig):
+        return self.compact_context(state, config)
+
+    @staticmethod
+    def _prompt(state: AgentState):
+        # The system prompt comes first and never changes, so the provider can cache the
+        # prefix; the summary only changes when the context is compacted.
+        messages = [SystemMessage(content=TOOLS_SYSTEM_PROMPT)]
+        if state.get('summary'):
+            messages.append(SystemMessage(content=SUMMARY_PROMPT + state['summary']))
+        return messages + state['messages']
 
-    def call_tools_llm(self, state: AgentState):
-        messages = state['messages']
-        messages = [SystemMessage(content=TOOLS_SYSTEM_PROMPT)] + messages
-        message = self._tools_llm.invoke(messages)
-        return {'messages': [message]}
+    def call_tools_llm(self, state: AgentState, config: RunnableConfig):
+        budget = self._budget(state, config)
+        self._start_prefetch(state)
+        messages = self._prompt(state)
+        key, message = self._cached_response(messages)
+        if message is None:
+            message = self._invoke_llm(self._tools_llm, self._tools_model, messages)
+            self._cache_response(key, message)
+        self._finish_prefetch(message)
+        return {'messages': [message], 'budget': self._spend(budget, message)}
 
-    def invoke_tools(self, state: AgentState):
+    async def acall_tools_llm(self, state: AgentState, config: RunnableConfig):
+        budget = self._budget(state, config)
+        self._start_prefetch(state)
+        messages = self._prompt(state)
+        key, message = self._cached_response(messages)
+        if message is None:
+            message = await self._ainvoke_llm(self._tools_llm, self._tools_model, messages)
+            self._cache_response(key, message)
+        self._finish_prefetch(message)
+        return {'messages': [message], 'budget': self._spend(budget, message)}
+
+    def final_answer(self, state: AgentState, config: RunnableConfig):
+        skipped, messages, budget = self._final_answer_inputs(state, config)
+        message = self._invoke_llm(self._final_llm, self._tools_model, messages)
+        return self._final_answer_update(skipped, message, budget)
+
+    async def afinal_answer(self, state: AgentState, config: RunnableConfig):
+        skipped, messages, budget = self._final_answer_inputs(state, config)
+        message = await self._ainvoke_llm(self._final_llm, self._tools_model, messages)
+        return self._final_answer_update(skipped, message, budget)
+
+    def _final_answer_inputs(self, state: AgentState, config: RunnableConfig):
+        budget = self._spend(self._budget(state, config))
+        budget['exhausted'] = exhausted_budget(budget) or 'budget'
+        print(f"Budget exhausted ({budget['exhausted']}), forcing a final answer")
+        # Tool calls the model asked for but that were not run still need an answer for the API.
+        last = state['messages'][-1]
+        skipped = [
+            ToolMessage(tool_call_id=t['id'], name=t['name'], content=f"Not run: the run's {budget['exhausted']} budget is used up.")
+            for t in getattr(last, 'tool_calls', None) or []
+        ]
+        messages = self._prompt(state) + skipped + [SystemMessage(content=FINAL_ANSWER_PROMPT)]
+        return skipped, messages, budget
+
+    def _final_answer_update(self, skipped, message: AIMessage, budget: dict):
+        if message.tool_calls:
+            # No tools are bound, but never let a tool call through: the run must end here.
+            message = AIMessage(content=message.content or 'Sorry, I could not finish planning this trip in time.',
+                                usage_metadata=message.usage_metadata)
+        return {'messages': skipped + [message], 'budget': self._spend(budget, message)}
+
+    def _cached_response(self, messages):
+        '''(cache key, cached AIMessage or None) for the messages about to be sent.'''
+        if self._llm_cache is None:
+            return None, None
+        key = self._llm_cache.key(messages)
+        message = self._llm_cache.get(key)
+        METRICS.emit('cache', self._tools_model, hit=message is not None)
+        return key, message
+
+    def _cache_response(self, key, message):
+        if key is not None:
+            self._llm_cache.set(key, message)
+
+    @staticmethod
+    def _invoke_llm(llm, model: str, messages):
+        '''Call a chat model under the request budget and the shared OpenAI rate limiter.'''
+        def attempt():
+            QUOTA.consume('openai')
+            with METRICS.timed('llm', model) as fields:
+                message = llm.invoke(messages)
+                fields.update(llm_usage(message))
+            return message
+        return OPENAI_LIMITER.call(attempt)
+
+    @staticmethod
+    async def _ainvoke_llm(llm, model: str, messages):
+        async def attempt():
+            QUOTA.consume('openai')
+            with METRICS.timed('llm', model) as fields:
+                message = await llm.ainvoke(messages)
+                fields.update(llm_usage(message))
+            return message
+        return await OPENAI_LIMITER.acall(attempt)
+
+    def _start_prefetch(self, state: AgentState):
+        last = state['messages'][-1]
+        if self._prefetcher and isinstance(last, HumanMessage) and isinstance(last.content, str):
+            self._prefetcher.start(current_thread_id.get(), last.content)
+
+    def _finish_prefetch(self, message: AIMessage):
+        # The final answer ends the run: whatever was not claimed by now was wasted.
+        if self._prefetcher and not message.tool_calls:
+            self._prefetcher.finish(current_thread_id.get())
+
+    def _claim_prefetch(self, t):
+        if self._prefetcher is None:
+            return None
+        return self._prefetcher.claim(current_thread_id.get(), t['name'], t['args'])
+
+    @staticmethod
+    def _serpapi_allowance(budget: dict):
+        limit = budget['limits']['max_serpapi_calls']
+        return max(limit - budget['serpapi_calls'], 0) if limit else None
+
+    def invoke_tools(self, state: AgentState, config: RunnableConfig):
         tool_calls = state['messages'][-1].tool_calls
-        results = []
-        for t in tool_calls:
-            print(f'Calling: {t}')
-            if not t['name'] in self._tools:
-                print('\n ....bad tool name....')
-                result = 'bad tool name, retry'
+        budget = self._spend(self._budget(state, config))
+        with serpapi_client.allowance(self._serpapi_allowance(budget)):
+            results = self._run_tool_calls(tool_calls)
+        print('Back to the model!')
+        return {
+            'messages': [
+                ToolMessage(tool_call_id=t['id'], name=t['name'], content=tool_content(results[t['id']])) for t in tool_calls
+            ],
+            'budget': self._spend(budget)
+        }
+
+    def _call_tool(self, t):
+        print(f'Calling: {t}')
+        if not t['name'] in self._tools:
+            print('\n ....bad tool name....')
+            return 'bad tool name, retry'
+        prefetched = self._claim_prefetch(t)
+        with METRICS.timed('tool', t['name'], prefetched=prefetched is not None) as fields:
+            if prefetched is not None:
+                result = prefetched.result(timeout=TOOL_CALL_TIMEOUT)
             else:
                 result = self._tools[t['name']].invoke(t['args'])
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
+            fields['bytes'] = len(tool_content(result))
+        return result
+
+    def _run_tool_calls(self, tool_calls):
+        '''Run the tool calls of one model turn concurrently, at most TOOLS_MAX_FANOUT at a time.
+
+        Every call gets TOOL_CALL_TIMEOUT seconds from the moment it starts; calls that are
+        still queued when the whole batch runs out of time are cancelled. Returns a dict of
+        results keyed by tool_call_id so the caller can keep the original call order.
+        '''
+        if not tool_calls:
+            return {}
+        fanout = max(1, min(len(tool_calls), TOOLS_MAX_FANOUT))
+        deadline = time.monotonic() + TOOL_CALL_TIMEOUT * math.ceil(len(tool_calls) / fanout)
+        started = {}
+
+        def run(t):
+            started[t['id']] = time.monotonic()
+            return self._call_tool(t)
+
+        executor = ThreadPoolExecutor(max_workers=fanout, thread_name_prefix='invoke_tools')
+        # Each call gets its own copy of the context so metrics keep the run's thread_id.
+        pending = {executor.submit(contextvars.copy_context().run, run, t): t for t in tool_calls}
+        results = {}
+        try:
+            while pending:
+                now = time.monotonic()
+                expiries = [started[t['id']] + TOOL_CALL_TIMEOUT for t in pending.values() if t['id'] in started]
+                timeout = max(0.0, min(expiries + [deadline]) - now)
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    t = pending.pop(future)
+                    try:
+                        results[t['id']] = future.result()
+                    except Exception as e:
+                        results[t['id']] = f'Error calling {t["name"]}: {e}'
+                now = time.monotonic()
+                for future, t in list(pending.items()):
+                    start = started.get(t['id'])
+                    if now >= deadline or (start is not None and now - start >= TOOL_CALL_TIMEOUT):
+                        future.cancel()
+                        del pending[future]
+                        print(f'Timed out: {t["name"]} ({t["id"]})')
+                        results[t['id']] = f'{t["name"]} timed out after {TOOL_CALL_TIMEOUT:g}s, retry later'
+        finally:
+            # Stragglers keep running in the background but their results are discarded.
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    async def ainvoke_tools(self, state: AgentState, config: RunnableConfig):
+        tool_calls = state['messages'][-1].tool_calls
+        budget = self._spend(self._budget(state, config))
+        semaphore = asyncio.Semaphore(max(1, TOOLS_MAX_FANOUT))
+
+        async def run(t):
+            async with semaphore:
+                print(f'Calling: {t}')
+                if not t['name'] in self._tools:
+                    print('\n ....bad tool name....')
+                    return 'bad tool name, retry'
+                prefetched = self._claim_prefetch(t)
+                try:
+                    with METRICS.timed('tool', t['name'], prefetched=prefetched is not None) as fields:
+                        if prefetched is not None:
+                            pending = asyncio.wrap_future(prefetched)
+                        else:
+                            pending = self._tools[t['name']].ainvoke(t['args'])
+                        # wait_for cancels the underlying request when the deadline passes.
+                        result = await asyncio.wait_for(pending, TOOL_CALL_TIMEOUT)
+                        fields['bytes'] = len(tool_content(result))
+                    return result
+                except asyncio.TimeoutError:
+                    print(f'Timed out: {t["name"]} ({t["id"]})')
+                    return f'{t["name"]} timed out after {TOOL_CALL_TIMEOUT:g}s, retry later'
+                except Exception as e:
+                    return f'Error calling {t["name"]}: {e}'
+
+        with serpapi_client.allowance(self._serpapi_allowance(budget)):
+            # gather() starts a task per call, each with a copy of this context.
+            results = await asyncio.gather(*(run(t) for t in tool_calls))
         print('Back to the model!')
-        return {'messages': results}
\ No newline at end of file
+        return {
+            'messages': [
+                ToolMessage(tool_call_id=t['id'], name=t['name'], content=tool_content(result)) for t, result in zip(tool_calls, results)
+            ],
+            'budget': self._spend(budget)
+        }
+
+
+_agent = None
+_agent_lock = threading.Lock()
+
+
+def get_agent() -> Agent:
+    '''Return the process-wide Agent.
+
+    The compiled graph holds no per-user state, so all sessions share it and are kept
+    apart by the thread_id in their config.
+    '''
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                _agent = Agent()
+                if METRICS_PORT:
+                    METRICS.serve(METRICS_PORT)
+    return _agent
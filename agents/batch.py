@@ -0,0 +1,217 @@
+'''Headless batch planning over JSONL.
+
+Reads one query per line from the input file, e.g.
+
+    {"id": "spring-01", "query": "A week in Lisbon from Berlin, May 3rd to 10th"}
+
+runs it through the shared agent graph on a pool of workers and appends one result
+per line to the output file as soon as the plan is ready. Ids that already have a
+successful result in the output file are skipped, so an interrupted run is resumed by
+starting it again with the same arguments. The OpenAI and SerpAPI request budgets stop
+the run cleanly once spent; unfinished queries are picked up by the next run.
+
+    python -m agents.batch queries.jsonl plans.jsonl --workers 8 --openai-budget 500
+'''
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from langchain_core.messages import HumanMessage
+
+from agents.metrics import METRICS
+from agents.quota import QUOTA, QuotaExceeded
+
+
+def read_jobs(path: str):
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            if isinstance(job, str):
+                job = {'query': job}
+            job.setdefault('id', str(line_number))
+            job['id'] = str(job['id'])
+            yield job
+
+
+def completed_ids(path: str) -> set:
+    '''Ids with a successful result in an existing output file; a torn last line is ignored.'''
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get('status') == 'ok':
+                done.add(str(result['id']))
+    return done
+
+
+class ResultWriter:
+    '''Appends results to the output JSONL, one flushed line per finished job.'''
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+')
+        # A crash can leave a partial last line; start on a fresh one.
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != '\n':
+                self._file.write('\n')
+
+    def write(self, result: dict):
+        line = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def plan(agent, job: dict) -> dict:
+    thread_id = f'batch-{job["id"]}-{uuid.uuid4().hex[:8]}'
+    config = {'configurable': {'thread_id': thread_id}}
+    started = time.perf_counter()
+    state = agent.graph.invoke({'messages': [HumanMessage(content=job['query'])]}, config)
+    return {
+        'id': job['id'],
+        'status': 'ok',
+        'query': job['query'],
+        'thread_id': thread_id,
+        'plan': state['messages'][-1].content,
+        'elapsed': round(time.perf_counter() - started, 3),
+        'budget': state.get('budget'),
+        'usage': METRICS.memory.thread(thread_id)
+    }
+
+
+def email_plan(agent, job: dict, thread_id: str):
+    '''Resume the finished run to email its plan; returns the error, if any, instead of raising.'''
+    configurable = {
+        'thread_id': thread_id,
+        'to_email': job.get('to_email'),
+        'email_subject': job.get('email_subject')
+    }
+    try:
+        agent.graph.invoke(None, {'configurable': {k: v for k, v in configurable.items() if v}})
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return None
+
+
+def run(input_path: str, output_path: str, workers: int = 4, send_email: bool = False, agent=None) -> dict:
+    '''Plan every pending job of the input file; returns counts of the outcomes.'''
+    if agent is None:
+        from agents.agent import get_agent
+        agent = get_agent()
+    done = completed_ids(output_path)
+    writer = ResultWriter(output_path)
+    counts = {'ok': 0, 'error': 0, 'skipped': 0, 'not_started': 0}
+    stop = threading.Event()
+
+    def run_job(job):
+        with QUOTA.track() as refused:
+            try:
+                result = plan(agent, job)
+            except QuotaExceeded as e:
+                print(f'Stopping: {e}', file=sys.stderr)
+                stop.set()
+                return None
+            except Exception as e:
+                result = {'id': job['id'], 'status': 'error', 'query': job['query'], 'error': f'{type(e).__name__}: {e}'}
+        if refused:
+            # A request of this plan was refused, so it may rest on missing results.
+            print(f'Stopping: {refused[0]} request budget exhausted', file=sys.stderr)
+            stop.set()
+            return None
+        if send_email and result['status'] == 'ok':
+            # The plan is kept even when the email fails; the error is recorded next to it.
+            email_error = email_plan(agent, job, result['thread_id'])
+            if email_error:
+                result['email_error'] = email_error
+        return result
+
+    pending = set()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='batch') as pool:
+            for job in read_jobs(input_path):
+                if job['id'] in done:
+                    counts['skipped'] += 1
+                    continue
+                if stop.is_set():
+                    counts['not_started'] += 1
+                    continue
+                # Keep the queue short so a stop or a crash leaves few jobs half-done.
+                while len(pending) >= 2 * max(1, workers):
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    _record(finished, writer, counts)
+                pending.add(pool.submit(run_job, job))
+                done.add(job['id'])
+            _record(pending, writer, counts, wait_all=True)
+    finally:
+        writer.close()
+    if send_email:
+        agent._email_queue.join()
+    counts['quota'] = QUOTA.stats()
+    return counts
+
+
+def _record(futures, writer, counts, wait_all=False):
+    if wait_all:
+        futures, _ = wait(futures)
+    for future in futures:
+        result = future.result()
+        if result is None:
+            # Cut short by the request budget: not written, so the next run retries it.
+            counts['not_started'] += 1
+            continue
+        writer.write(result)
+        counts[result['status']] += 1
+        print(f"[{result['status']}] {result['id']}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='JSONL file with one {"id", "query"} object per line')
+    parser.add_argument('output', help='JSONL file the results are appended to')
+    parser.add_argument('--workers', type=int, default=4, help='queries planned at the same time')
+    parser.add_argument('--openai-budget', type=int, help='maximum OpenAI requests for this run')
+    parser.add_argument('--serpapi-budget', type=int, help='maximum SerpAPI requests for this run')
+    parser.add_argument('--send-email', action='store_true',
+                        help="also email every plan (to the job's to_email or TO_EMAIL)")
+    parser.add_argument('--verbose', action='store_true', help="show the agent's own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.openai_budget is not None:
+        QUOTA.set_limit('openai', args.openai_budget)
+    if args.serpapi_budget is not None:
+        QUOTA.set_limit('serpapi', args.serpapi_budget)
+    # The agent prints every tool call; keep stdout for the summary unless asked otherwise.
+    # Discarded, not buffered: a long batch prints far too much to hold in memory.
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        counts = run(args.input, args.output, args.workers, args.send_email)
+    print(json.dumps(counts, indent=2))
+    return 0 if counts['error'] == 0 and counts['not_started'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
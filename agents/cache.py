@@ -0,0 +1,137 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from agents import db
+
+
+# Request parameters whose values mean the same in any case: IATA codes, currency,
+# country and language. Everything else (free-text queries, page and booking tokens)
+# is compared verbatim.
+CASE_INSENSITIVE_KEYS = ('engine', 'departure_id', 'arrival_id', 'currency', 'gl', 'hl')
+
+
+def make_key(params: dict, exclude=('api_key',)) -> str:
+    '''Stable key for a dict of request parameters.
+
+    None values and the excluded keys are dropped and the remaining values are compared
+    as whitespace-trimmed strings, so `{'adults': 1}` and `{'adults': '1'}` hit the same
+    entry. Values of CASE_INSENSITIVE_KEYS are also lowercased, so `'ams'` and `'AMS '`
+    do too.
+    '''
+    normalized = {}
+    for k, v in params.items():
+        if v is None or k in exclude:
+            continue
+        v = str(v).strip()
+        normalized[k] = v.lower() if k in CASE_INSENSITIVE_KEYS else v
+    payload = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class TTLCache:
+    '''Thread-safe LRU cache with per-entry expiry and optional SQLite write-through.
+
+    Values must be JSON serializable. When `path` is set, entries are also stored in the
+    SQLite file so they survive restarts and are shared between worker processes; the
+    in-memory LRU stays the first lookup level.
+    '''
+
+    _PRUNE_EVERY = 100
+
+    def __init__(self, name: str, ttl: float = None, maxsize: int = 128, path: str = None):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = None
+        if path:
+            self._conn = db.connect(path)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'expires_at REAL, written_at REAL NOT NULL, PRIMARY KEY (namespace, key))'
+            )
+
+    def get(self, key: str, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?',
+                    (self.name, key)
+                ).fetchone()
+                if row is not None and (row[1] is None or row[1] > now):
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value):
+        if self.maxsize <= 0:
+            return
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._conn is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, written_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (self.name, key, json.dumps(value, separators=(',', ':')), expires_at, now)
+                )
+                self._writes += 1
+                if self._writes % self._PRUNE_EVERY == 0:
+                    self._prune_disk(now)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM cache_entries WHERE namespace = ?', (self.name,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'ttl': self.ttl
+            }
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _prune_disk(self, now):
+        self._conn.execute(
+            'DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?',
+            (self.name, now)
+        )
+        # Keep the file bounded as well: only the most recently written entries survive.
+        self._conn.execute(
+            'DELETE FROM cache_entries WHERE namespace = ? AND key NOT IN ('
+            'SELECT key FROM cache_entries WHERE namespace = ? ORDER BY written_at DESC LIMIT ?)',
+            (self.name, self.name, self.maxsize)
+        )
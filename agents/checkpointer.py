@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from agents import db
+from agents.config import env_bool, env_float, env_int, env_str
+
+# 'sqlite' keeps threads on disk so they survive restarts and can be resumed by any
+# worker process; 'memory' keeps the previous in-process MemorySaver behaviour.
+CHECKPOINTER = env_str('CHECKPOINTER', 'sqlite')
+CHECKPOINT_DB = env_str('CHECKPOINT_DB', 'checkpoints.sqlite')
+# Threads untouched for this many seconds are deleted.
+CHECKPOINT_TTL = env_float('CHECKPOINT_TTL', 24 * 3600.0)
+# Only the most recently active threads are kept beyond this count.
+CHECKPOINT_MAX_THREADS = env_int('CHECKPOINT_MAX_THREADS', 10000)
+CHECKPOINT_PRUNE_INTERVAL = env_float('CHECKPOINT_PRUNE_INTERVAL', 60.0)
+# Store each message once and let checkpoints refer to it, instead of copying the whole
+# history into every checkpoint.
+CHECKPOINT_DELTA = env_bool('CHECKPOINT_DELTA', True)
+# Message contents of at least this many characters (tool payloads) are stored once by
+# content hash, however many messages and threads carry them.
+CHECKPOINT_PAYLOAD_MIN_CHARS = env_int('CHECKPOINT_PAYLOAD_MIN_CHARS', 1024)
+# Serialized bytes of the latest messages remembered per thread, so unchanged messages are
+# not serialized again; least recently written threads are forgotten first.
+CHECKPOINT_DELTA_CACHE_BYTES = env_int('CHECKPOINT_DELTA_CACHE_BYTES', 8 * 1024 * 1024)
+
+
+class PrunedSqliteSaver(SqliteSaver):
+    '''SqliteSaver that forgets old threads.
+
+    Every checkpoint write records the thread's last activity. At most every
+    `prune_interval` seconds, threads idle for longer than `ttl` and threads beyond the
+    `max_threads` most recent ones are deleted together with their pending writes.
+    The async methods run the sync implementation in a worker thread, so the same saver
+    serves graph.invoke and graph.ainvoke.
+    '''
+
+    def __init__(self, conn, *, ttl: float = CHECKPOINT_TTL, max_threads: int = CHECKPOINT_MAX_THREADS,
+                 prune_interval: float = CHECKPOINT_PRUNE_INTERVAL, serde=None):
+        super().__init__(conn, serde=serde)
+        self.ttl = ttl
+        self.max_threads = max_threads
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS thread_activity_updated_at ON thread_activity (updated_at)'
+        )
+
+    def put(self, config, checkpoint, metadata, *args, **kwargs):
+        next_config = super().put(config, checkpoint, metadata, *args, **kwargs)
+        with self.cursor() as cur:
+            cur.execute(
+                'INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)',
+                (str(config['configurable']['thread_id']), time.time())
+            )
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune()
+        return next_config
+
+    @contextmanager
+    def _transaction(self):
+        '''Cursor inside BEGIN IMMEDIATE ... COMMIT.
+
+        The connection is in autocommit mode and self.lock only serializes this process, so
+        statements that must be seen together by other processes sharing the file run in
+        one write transaction.
+        '''
+        with self.cursor(transaction=False) as cur:
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                yield cur
+                cur.execute('COMMIT')
+            except BaseException:
+                cur.execute('ROLLBACK')
+                raise
+
+    def prune(self) -> int:
+        '''Delete expired and surplus threads, returning how many were removed.'''
+        self._last_prune = time.monotonic()
+        with self._transaction() as cur:
+            cur.execute(
+                'SELECT thread_id FROM thread_activity WHERE updated_at < ? '
+                'UNION SELECT thread_id FROM ('
+                'SELECT thread_id FROM thread_activity ORDER BY updated_at DESC LIMIT -1 OFFSET ?)',
+                (time.time() - self.ttl, self.max_threads)
+            )
+            stale = [(row[0],) for row in cur.fetchall()]
+            if stale:
+                self._delete_threads(cur, stale)
+        return len(stale)
+
+    def _delete_threads(self, cur, stale: list):
+        cur.executemany('DELETE FROM writes WHERE thread_id = ?', stale)
+        cur.executemany('DELETE FROM checkpoints WHERE thread_id = ?', stale)
+        cur.executemany('DELETE FROM thread_activity WHERE thread_id = ?', stale)
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoints = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata, *args, **kwargs):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, *args, **kwargs)
+
+    async def aput_writes(self, config, writes, task_id):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+
+class DeltaSqliteSaver(PrunedSqliteSaver):
+    '''PrunedSqliteSaver that stores messages once instead of once per checkpoint.
+
+    LangGraph writes the full channel values at every step, so with the message history
+    in the state the bytes serialized and stored grow quadratically with the length of
+    the tool loop. Here every list of messages in a checkpoint or pending write is
+    replaced by references to rows of checkpoint_blobs, keyed by the hash of the
+    serialized message: a step only inserts the messages that are new, and the
+    checkpoint itself shrinks to a list of hashes. Contents of at least
+    `payload_min_chars` characters (the SerpAPI results) go to checkpoint_payloads,
+    keyed by their own hash, so identical payloads are stored once across threads.
+
+    The references are resolved again in get_tuple() and list(), so the graph, its
+    interrupts and get_state() see the complete state. Checkpoints written by a plain
+    SqliteSaver are read as they are. Pruned threads release their references, and
+    blobs and payloads no thread refers to any more are deleted.
+    '''
+
+    _REF = '__blob__'
+
+    def __init__(self, conn, *, payload_min_chars: int = CHECKPOINT_PAYLOAD_MIN_CHARS,
+                 cache_bytes: int = CHECKPOINT_DELTA_CACHE_BYTES, **kwargs):
+        super().__init__(conn, **kwargs)
+        self.payload_min_chars = payload_min_chars
+        self.cache_bytes = cache_bytes
+        # thread_id -> {id(message): (message, hash, bytes)} for the messages last stored for
+        # the thread. Holding the messages keeps their id() from being reused.
+        self._known = OrderedDict()
+        self._known_bytes = {}
+        self._known_total = 0
+        self._known_lock = threading.Lock()
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            'CREATE TABLE IF NOT EXISTS checkpoint_blobs ('
+            'hash TEXT PRIMARY KEY, type TEXT NOT NULL, value BLOB NOT NULL, payload TEXT);'
+            'CREATE TABLE IF NOT EXISTS checkpoint_payloads (hash TEXT PRIMARY KEY, content TEXT NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS checkpoint_blob_refs ('
+            'thread_id TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (thread_id, hash));'
+        )
+
+    def put(self, config, checkpoint, metadata, *args, **kwargs):
+        thread_id = str(config['configurable']['thread_id'])
+        channel_values = {
+            channel: self._store(thread_id, value, replace=True)
+            for channel, value in checkpoint['channel_values'].items()
+        }
+        return super().put(config, {**checkpoint, 'channel_values': channel_values}, metadata, *args, **kwargs)
+
+    def put_writes(self, config, writes, task_id):
+        thread_id = str(config['configurable']['thread_id'])
+        writes = [(channel, self._store(thread_id, value)) for channel, value in writes]
+        return super().put_writes(config, writes, task_id)
+
+    def get_tuple(self, config):
+        return self._resolve(super().get_tuple(config))
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        # SqliteSaver.list yields while holding the connection lock, which _resolve needs.
+        checkpoint_tuples = list(super().list(config, filter=filter, before=before, limit=limit))
+        for checkpoint_tuple in checkpoint_tuples:
+            yield self._resolve(checkpoint_tuple)
+
+    def _delete_threads(self, cur, stale: list):
+        super()._delete_threads(cur, stale)
+        cur.executemany('DELETE FROM checkpoint_blob_refs WHERE thread_id = ?', stale)
+        cur.execute('DELETE FROM checkpoint_blobs WHERE hash NOT IN (SELECT hash FROM checkpoint_blob_refs)')
+        cur.execute(
+            'DELETE FROM checkpoint_payloads WHERE hash NOT IN '
+            '(SELECT payload FROM checkpoint_blobs WHERE payload IS NOT NULL)'
+        )
+        with self._known_lock:
+            for (thread_id,) in stale:
+                self._forget(thread_id)
+
+    @staticmethod
+    def _is_messages(value) -> bool:
+        return isinstance(value, list) and bool(value) and all(isinstance(m, BaseMessage) for m in value)
+
+    def _store(self, thread_id: str, value, replace: bool = False):
+        '''References for a list of messages, inserting the ones not stored yet; other values as they are.
+
+        With `replace`, the messages remembered for the thread become exactly these (a
+        checkpoint holds the whole history); otherwise they are added (pending writes).
+        '''
+        if not self._is_messages(value):
+            return value
+        with self._known_lock:
+            known = self._known.get(thread_id, {})
+        while True:
+            current = {} if replace else known
+            blobs, payloads, refs = [], {}, []
+            for message in value:
+                entry = known.get(id(message))
+                if entry is None:
+                    blob, payload = self._blob(message)
+                    blobs.append(blob)
+                    if payload is not None:
+                        payloads[payload[0]] = payload
+                    entry = (message, blob[0], len(blob[2]) + (len(payload[1]) if payload else 0))
+                current[id(message)] = entry
+                refs.append({self._REF: entry[1]})
+            # One transaction, so a concurrent prune can't delete a blob or payload that
+            # already existed between these inserts and the reference to it.
+            with self._transaction() as cur:
+                pruned = bool(known) and cur.execute(
+                    'SELECT 1 FROM checkpoint_blob_refs WHERE thread_id = ? LIMIT 1', (thread_id,)
+                ).fetchone() is None
+                if blobs and not pruned:
+                    cur.executemany('INSERT OR IGNORE INTO checkpoint_payloads (hash, content) VALUES (?, ?)',
+                                    list(payloads.values()))
+                    cur.executemany('INSERT OR IGNORE INTO checkpoint_blobs (hash, type, value, payload) '
+                                    'VALUES (?, ?, ?, ?)', blobs)
+                    cur.executemany('INSERT OR IGNORE INTO checkpoint_blob_refs (thread_id, hash) VALUES (?, ?)',
+                                    [(thread_id, blob[0]) for blob in blobs])
+            if not pruned:
+                break
+            # Another process pruned the thread and its blobs: store every message again.
+            known = {}
+        self._remember(thread_id, current)
+        return refs
+
+    def _remember(self, thread_id: str, known: dict):
+        size = sum(entry[2] for entry in known.values())
+        with self._known_lock:
+            self._forget(thread_id)
+            if size > self.cache_bytes:
+                return
+            self._known[thread_id] = known
+            self._known_bytes[thread_id] = size
+            self._known_total += size
+            while self._known_total > self.cache_bytes:
+                self._forget(next(iter(self._known)))
+
+    def _forget(self, thread_id: str):
+        self._known.pop(thread_id, None)
+        self._known_total -= self._known_bytes.pop(thread_id, 0)
+
+    def _blob(self, message: BaseMessage):
+        '''((hash, type, value, payload hash), (payload hash, content) or None) for a message.'''
+        payload = None
+        if isinstance(message.content, str) and len(message.content) >= self.payload_min_chars:
+            payload = (hashlib.sha256(message.content.encode()).hexdigest(), message.content)
+            message = message.copy(update={'content': ''})
+        type_, value = self.serde.dumps_typed(message)
+        digest = hashlib.sha256(type_.encode() + b'\0' + value + b'\0' + (payload[0].encode() if payload else b''))
+        return (digest.hexdigest(), type_, value, payload and payload[0]), payload
+
+    def _is_refs(self, value) -> bool:
+        return isinstance(value, list) and bool(value) and all(
+            isinstance(r, dict) and r.keys() == {self._REF} for r in value
+        )
+
+    def _resolve(self, checkpoint_tuple):
+        if checkpoint_tuple is None:
+            return None
+        checkpoint = checkpoint_tuple.checkpoint
+        hashes = {r[self._REF] for value in checkpoint['channel_values'].values() if self._is_refs(value) for r in value}
+        for _, _, value in checkpoint_tuple.pending_writes or []:
+            if self._is_refs(value):
+                hashes.update(r[self._REF] for r in value)
+        if not hashes:
+            return checkpoint_tuple
+        messages = self._load(hashes)
+
+        def resolve(value):
+            return [messages[r[self._REF]] for r in value] if self._is_refs(value) else value
+
+        checkpoint = {**checkpoint, 'channel_values': {k: resolve(v) for k, v in checkpoint['channel_values'].items()}}
+        pending_writes = [(task_id, channel, resolve(value)) for task_id, channel, value in checkpoint_tuple.pending_writes or []]
+        return checkpoint_tuple._replace(checkpoint=checkpoint, pending_writes=pending_writes)
+
+    def _load(self, hashes: set) -> dict:
+        hashes = list(hashes)
+        messages = {}
+        with self.cursor(transaction=False) as cur:
+            # Stay well below SQLite's limit on bound parameters.
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                cur.execute(
+                    'SELECT b.hash, b.type, b.value, b.payload, p.content FROM checkpoint_blobs b '
+                    'LEFT JOIN checkpoint_payloads p ON p.hash = b.payload '
+                    f'WHERE b.hash IN ({",".join("?" * len(chunk))})', chunk
+                )
+                # One row at a time, so the raw rows are not all held next to the messages.
+                for digest, type_, value, payload, content in cur:
+                    if payload is not None and content is None:
+                        raise KeyError(f'Message blob {digest} refers to missing payload {payload}')
+                    message = self.serde.loads_typed((type_, value))
+                    if payload is not None:
+                        message.content = content
+                    messages[digest] = message
+        missing = set(hashes) - messages.keys()
+        if missing:
+            raise KeyError(f'Checkpoint refers to {len(missing)} missing message blob(s)')
+        return messages
+
+
+def make_checkpointer():
+    if CHECKPOINTER == 'memory':
+        return MemorySaver()
+    if CHECKPOINTER != 'sqlite':
+        raise ValueError(f'Unknown CHECKPOINTER {CHECKPOINTER!r}, expected "sqlite" or "memory"')
+    saver = DeltaSqliteSaver if CHECKPOINT_DELTA else PrunedSqliteSaver
+    return saver(db.connect(CHECKPOINT_DB))
@@ -0,0 +1,27 @@
+import os
+
+from dotenv import load_dotenv
+
+_ = load_dotenv()
+
+
+def env_str(name: str, default: str = None):
+    value = os.environ.get(name)
+    return default if value in (None, '') else value
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return default if value in (None, '') else int(value)
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return default if value in (None, '') else float(value)
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,161 @@
+import json
+import re
+import warnings
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+
+from agents.config import env_int
+
+# Estimated tokens of history (and rolling summary) sent to the tools model before older
+# turns are compacted, 0 to never compact. A run can override it with the
+# context_max_tokens key of its configurable.
+CONTEXT_MAX_TOKENS = env_int('CONTEXT_MAX_TOKENS', 8000)
+# Most recent human turns (the current one included) compacted only when older turns are
+# not enough; the current turn itself is always kept verbatim.
+CONTEXT_KEEP_TURNS = env_int('CONTEXT_KEEP_TURNS', 2)
+# Characters a digested tool result is cut to.
+CONTEXT_DIGEST_CHARS = env_int('CONTEXT_DIGEST_CHARS', 400)
+# Estimated tokens of the rolling summary of older turns; its oldest entries are dropped first.
+CONTEXT_SUMMARY_TOKENS = env_int('CONTEXT_SUMMARY_TOKENS', 1000)
+
+SUMMARY_PROMPT = 'Summary of the earlier conversation with this traveller, oldest first:\n'
+
+DIGEST_PREFIX = '[digest] '
+# Fields of tool results that cost many tokens and are of no use once the turn is answered.
+_DIGEST_DROP = ('link', 'logo', 'thumbnail', 'image', 'token', 'url', 'cursor')
+_DIGEST_ITEMS = 3
+_MARKDOWN_IMAGE = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+_MARKDOWN_LINK = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+
+
+def estimate_text(text: str) -> int:
+    # About four characters per token for English and JSON; close enough to decide when to compact.
+    return len(text) // 4
+
+
+def estimate_tokens(messages) -> int:
+    chars = 0
+    for message in messages:
+        content = message.content
+        chars += len(content if isinstance(content, str) else json.dumps(content, default=str))
+        for t in getattr(message, 'tool_calls', None) or []:
+            chars += len(t['name']) + len(json.dumps(t['args'], default=str))
+    # Plus the few tokens of framing every message costs.
+    return chars // 4 + 4 * len(messages)
+
+
+def _shrink(value):
+    if isinstance(value, dict):
+        return {
+            k: _shrink(v) for k, v in value.items()
+            if not any(d in k.lower() for d in _DIGEST_DROP) and v not in (None, '', [], {})
+        }
+    if isinstance(value, list):
+        items = [_shrink(v) for v in value[:_DIGEST_ITEMS]]
+        if len(value) > _DIGEST_ITEMS:
+            items.append(f'+{len(value) - _DIGEST_ITEMS} more')
+        return items
+    if isinstance(value, str) and len(value) > 80:
+        return value[:79] + '…'
+    return value
+
+
+def digest(content: str, limit: int = CONTEXT_DIGEST_CHARS) -> str:
+    '''Compact stand-in for a tool result: the first few options without links, images or tokens.'''
+    if content.startswith(DIGEST_PREFIX):
+        return content
+    try:
+        text = json.dumps(_shrink(json.loads(content)), separators=(',', ':'), ensure_ascii=False, default=str)
+    except ValueError:
+        text = content
+    if len(text) > limit:
+        text = text[:limit - 1] + '…'
+    return DIGEST_PREFIX + text
+
+
+def _clip(text, limit: int) -> str:
+    if not isinstance(text, str):
+        text = json.dumps(text, default=str)
+    # Logos and links were for the traveller; the summary only needs the facts.
+    text = _MARKDOWN_LINK.sub(r'\1', _MARKDOWN_IMAGE.sub('', text))
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def summarize_turn(turn: list) -> str:
+    '''One summary line for a human turn: the request, the tools used and the answer.'''
+    question = next((m.content for m in turn if isinstance(m, HumanMessage)), '')
+    answer = next((m.content for m in reversed(turn) if isinstance(m, AIMessage) and not m.tool_calls), '')
+    tools = sorted({m.name for m in turn if isinstance(m, ToolMessage) and m.name})
+    line = f'- User: {_clip(question, 300)}'
+    if tools:
+        line += f' | Looked up: {", ".join(tools)}'
+    return line + f' | Answer: {_clip(answer, 600) or "(none)"}'
+
+
+def _trim_summary(lines: list, max_tokens: int) -> str:
+    while len(lines) > 1 and estimate_text('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def compact(messages: list, summary: str = '', max_tokens: int = CONTEXT_MAX_TOKENS,
+            keep_turns: int = CONTEXT_KEEP_TURNS, summary_tokens: int = CONTEXT_SUMMARY_TOKENS):
+    '''Bring the history under `max_tokens` estimated tokens.
+
+    Returns (updates, summary): messages for the add_messages reducer (digested tool
+    results under their original ids, RemoveMessage for rolled-up messages) and the new
+    rolling summary. Nothing happens while the history fits. Otherwise, in this order
+    and only as far as needed:
+
+    1. tool results of turns older than the last `keep_turns` human turns are digested;
+    2. the oldest of those turns are removed and appended to the summary, one line each;
+    3. steps 1 and 2 are repeated for the kept turns before the current one.
+
+    The current turn is never changed: its tool results carry the links the answer and
+    the email need. If it does not fit on its own, the run's token budget ends the loop.
+    Whole turns are removed so every tool call keeps its result, as the API requires.
+    '''
+    summary = summary or ''
+    if not max_tokens or estimate_tokens(messages) + estimate_text(summary) <= max_tokens:
+        return [], summary
+    starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    keep = max(1, keep_turns)
+    kept_from = starts[-keep] if len(starts) >= keep else 0
+    current_from = starts[-1] if starts else 0
+    current = list(messages)
+    digested = {}
+    lines = summary.splitlines()
+
+    def digest_at(i):
+        m = current[i]
+        if isinstance(m, ToolMessage) and isinstance(m.content, str):
+            text = digest(m.content)
+            if len(text) < len(m.content):
+                current[i] = m.copy(update={'content': text})
+                digested[m.id] = current[i]
+
+    def over(start):
+        return estimate_tokens(current[start:]) + estimate_text(summary) > max_tokens
+
+    def roll_up(boundary, until):
+        # Digest the turns before `until`, then move the oldest into the summary while over.
+        nonlocal summary
+        for i in range(boundary, until):
+            digest_at(i)
+        while boundary < until and over(boundary):
+            end = next((s for s in starts if boundary < s <= until), until)
+            lines.append(summarize_turn(current[boundary:end]))
+            summary = _trim_summary(lines, summary_tokens)
+            boundary = end
+        return boundary
+
+    boundary = roll_up(0, kept_from)
+    if over(boundary):
+        boundary = roll_up(boundary, current_from)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', LangChainBetaWarning)
+        removed = [RemoveMessage(id=m.id) for m in current[:boundary]]
+    kept = [m for m in current[boundary:] if m.id in digested]
+    return removed + kept, summary
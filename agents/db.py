@@ -0,0 +1,9 @@
+import sqlite3
+
+
+def connect(path: str) -> sqlite3.Connection:
+    '''Open a SQLite database that can be shared by several threads and worker processes.'''
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
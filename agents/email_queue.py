@@ -0,0 +1,142 @@
+import os
+import queue
+import threading
+import time
+
+from agents.config import env_float, env_int
+from agents.metrics import METRICS, current_thread_id
+
+EMAIL_WORKERS = env_int('EMAIL_WORKERS', 1)
+EMAIL_MAX_ATTEMPTS = env_int('EMAIL_MAX_ATTEMPTS', 4)
+# Delay before the first retry; doubled on every further attempt.
+EMAIL_RETRY_BACKOFF = env_float('EMAIL_RETRY_BACKOFF', 2.0)
+
+
+class RetryableEmailError(Exception):
+    pass
+
+
+class EmailDeliveryError(Exception):
+    pass
+
+
+def mailersend_send(mail_body: dict):
+    # Imported on first delivery: most processes never send an email.
+    from mailersend import emails
+
+    mailer = emails.NewEmail(os.environ.get('MAILERSEND_API_KEY'))
+    # The SDK does not raise on HTTP errors, it returns "<status>\n<body>".
+    response = mailer.send(mail_body)
+    status, _, body = response.partition('\n')
+    status = int(status) if status.isdigit() else 0
+    if status == 429 or status >= 500 or status == 0:
+        raise RetryableEmailError(response)
+    if status >= 400:
+        raise EmailDeliveryError(response)
+    return response
+
+
+class EmailQueue:
+    '''Background delivery of emails with retries and exponential backoff.
+
+    submit() only enqueues the message and returns; worker threads send it. Transient
+    failures (network errors, 429, 5xx) are retried up to `max_attempts` times, while
+    other 4xx responses fail immediately. Every email that is delivered or given up on
+    emits an 'email' metrics event with its submit-to-delivery latency and attempts.
+    '''
+
+    def __init__(self, send=mailersend_send, workers: int = EMAIL_WORKERS,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, backoff: float = EMAIL_RETRY_BACKOFF):
+        self._send = send
+        self._workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._scheduled = 0
+        self._in_progress = 0
+
+    def submit(self, mail_body: dict):
+        self._start()
+        self._queue.put({'mail_body': mail_body, 'attempt': 1, 'submitted_at': time.monotonic(),
+                         'thread_id': current_thread_id.get()})
+
+    def join(self, timeout: float = None) -> bool:
+        '''Wait until every submitted email was delivered or gave up.'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                idle = self._queue.unfinished_tasks == 0 and self._scheduled == 0
+            if idle:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(max(1, self._workers)):
+                thread = threading.Thread(target=self._work, name=f'email-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._in_progress += 1
+            try:
+                self._deliver(job)
+            finally:
+                with self._lock:
+                    self._in_progress -= 1
+                self._queue.task_done()
+
+    def _deliver(self, job):
+        try:
+            response = self._send(job['mail_body'])
+        except Exception as e:
+            retryable = not isinstance(e, EmailDeliveryError)
+            if retryable and job['attempt'] < self.max_attempts:
+                delay = self.backoff * 2 ** (job['attempt'] - 1)
+                print(f'Error sending email (attempt {job["attempt"]}), retrying in {delay:g}s: {e}')
+                job['attempt'] += 1
+                with self._lock:
+                    self._scheduled += 1
+                timer = threading.Timer(delay, self._requeue, (job,))
+                timer.daemon = True
+                timer.start()
+            else:
+                print(f'Error sending email: {e}')
+                self._emit(job, error=f'{type(e).__name__}: {e}')
+            return
+        self._emit(job)
+        print('Email sent successfully')
+        print(response)
+
+    @staticmethod
+    def _emit(job, **fields):
+        # Workers run outside the graph run, so the run's thread_id is taken from the job.
+        METRICS.emit('email', 'mailersend', duration=time.monotonic() - job['submitted_at'],
+                     attempts=job['attempt'], **fields, thread_id=job['thread_id'])
+
+    def _requeue(self, job):
+        self._queue.put(job)
+        with self._lock:
+            self._scheduled -= 1
+
+
+_email_queue = None
+_email_queue_lock = threading.Lock()
+
+
+def get_email_queue() -> EmailQueue:
+    global _email_queue
+    if _email_queue is None:
+        with _email_queue_lock:
+            if _email_queue is None:
+                _email_queue = EmailQueue()
+    return _email_queue
@@ -0,0 +1,131 @@
+import html
+import re
+
+# Constructs the local renderer does not handle; plans containing them go to the LLM fallback.
+_UNSUPPORTED = re.compile(r'^\s*(```|~~~|<[a-zA-Z/!])', re.MULTILINE)
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_BULLET = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+_ORDERED = re.compile(r'^(\s*)\d+[.)]\s+(.*)$')
+_RULE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+
+_IMAGE = re.compile(r'!\[([^\]]*)\]\(([^)\s]+)(?:\s+"[^"]*")?\)')
+_LINK = re.compile(r'\[([^\]]+)\]\(([^)\s]+)(?:\s+"[^"]*")?\)')
+_BOLD = re.compile(r'(\*\*|__)(.+?)\1')
+_ITALIC = re.compile(r'(?<![\w*])([*_])(?!\s)(.+?)(?<!\s)\1(?![\w*])')
+_CODE = re.compile(r'`([^`]+)`')
+_AUTOLINK = re.compile(r'(?<!["=>])(https?://[^\s<]+)')
+
+_STYLE = {
+    'body': 'font-family:Arial,Helvetica,sans-serif;color:#333;line-height:1.5;max-width:680px;margin:0 auto;',
+    'h': 'color:#4158D0;margin:20px 0 8px;',
+    'img': 'max-width:120px;height:auto;vertical-align:middle;',
+    'table': 'border-collapse:collapse;width:100%;',
+    'cell': 'border:1px solid #d0d7de;padding:6px;text-align:left;'
+}
+
+
+def _inline(text: str) -> str:
+    '''Render inline markdown (images, links, bold, italic, code) inside escaped text.'''
+    placeholders = []
+
+    def keep(fragment):
+        placeholders.append(fragment)
+        return f'\x00{len(placeholders) - 1}\x00'
+
+    text = _IMAGE.sub(lambda m: keep(
+        f'<img src="{html.escape(m.group(2))}" alt="{html.escape(m.group(1))}" style="{_STYLE["img"]}">'
+    ), text)
+    text = _LINK.sub(lambda m: keep(
+        f'<a href="{html.escape(m.group(2))}">{html.escape(m.group(1))}</a>'
+    ), text)
+    text = _CODE.sub(lambda m: keep(f'<code>{html.escape(m.group(1))}</code>'), text)
+    text = html.escape(text, quote=False)
+    text = _AUTOLINK.sub(lambda m: f'<a href="{m.group(1)}">{m.group(1)}</a>', text)
+    text = _BOLD.sub(r'<strong>\2</strong>', text)
+    text = _ITALIC.sub(r'<em>\2</em>', text)
+    return re.sub('\x00(\\d+)\x00', lambda m: placeholders[int(m.group(1))], text)
+
+
+def _table_row(line: str, tag: str) -> str:
+    cells = [cell.strip() for cell in line.strip().strip('|').split('|')]
+    return '<tr>' + ''.join(f'<{tag} style="{_STYLE["cell"]}">{_inline(c)}</{tag}>' for c in cells) + '</tr>'
+
+
+def render_plan_html(markdown: str):
+    '''Convert a travel plan written in markdown into an HTML email body.
+
+    Handles what the travel agent writes: headings, paragraphs, bullet and numbered
+    lists (nested by indentation), tables, rules, bold/italic text, links and images.
+    The output only depends on the input. Returns None when the text contains
+    constructs outside that subset (code fences, raw HTML) so the caller can fall back
+    to another converter.
+    '''
+    if _UNSUPPORTED.search(markdown):
+        return None
+
+    out = []
+    paragraph = []
+    lists = []  # stack of (tag, indent)
+    lines = markdown.replace('\r\n', '\n').split('\n')
+
+    def close_paragraph():
+        if paragraph:
+            out.append('<p>' + '<br>'.join(_inline(line) for line in paragraph) + '</p>')
+            paragraph.clear()
+
+    def close_lists(indent=-1):
+        while lists and lists[-1][1] > indent:
+            out.append(f'</li></{lists.pop()[0]}>')
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].rstrip()
+        item = _BULLET.match(line) or _ORDERED.match(line)
+        if not line.strip():
+            close_paragraph()
+        elif _RULE.match(line):
+            close_paragraph()
+            close_lists()
+            out.append('<hr>')
+        elif _HEADING.match(line):
+            close_paragraph()
+            close_lists()
+            m = _HEADING.match(line)
+            level = len(m.group(1))
+            out.append(f'<h{level} style="{_STYLE["h"]}">{_inline(m.group(2))}</h{level}>')
+        elif '|' in line and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1]):
+            close_paragraph()
+            close_lists()
+            rows = [_table_row(line, 'th')]
+            i += 2
+            while i < len(lines) and '|' in lines[i] and lines[i].strip():
+                rows.append(_table_row(lines[i], 'td'))
+                i += 1
+            out.append(f'<table style="{_STYLE["table"]}">' + ''.join(rows) + '</table>')
+            continue
+        elif item:
+            close_paragraph()
+            indent = len(item.group(1).expandtabs(4))
+            tag = 'ul' if item.re is _BULLET else 'ol'
+            close_lists(indent)
+            if lists and lists[-1][1] == indent and lists[-1][0] != tag:
+                close_lists(indent - 1)
+            if lists and lists[-1][1] == indent:
+                out.append('</li>')
+            else:
+                out.append(f'<{tag}>')
+                lists.append((tag, indent))
+            out.append(f'<li>{_inline(item.group(2))}')
+        elif lists and lines[i].startswith((' ', '\t')):
+            # Continuation line of the current list item.
+            out.append('<br>' + _inline(line.strip()))
+        else:
+            close_lists()
+            paragraph.append(line.strip())
+        i += 1
+
+    close_paragraph()
+    close_lists()
+    return f'<html><body style="{_STYLE["body"]}">' + '\n'.join(out) + '</body></html>'
@@ -0,0 +1,50 @@
+import threading
+from typing import TYPE_CHECKING
+
+import httpx
+
+from agents.config import env_float, env_int
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+OPENAI_MAX_CONNECTIONS = env_int('OPENAI_MAX_CONNECTIONS', 20)
+OPENAI_TIMEOUT = env_float('OPENAI_TIMEOUT', 60.0)
+
+_lock = threading.Lock()
+_llms = {}
+_http_client = None
+
+
+def _get_http_client() -> httpx.Client:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(
+            timeout=OPENAI_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            )
+        )
+    return _http_client
+
+
+def get_llm(model: str, **kwargs) -> 'ChatOpenAI':
+    '''Return the process-wide ChatOpenAI client for a model and settings.
+
+    Clients are created once and share one keep-alive connection pool, so sessions and
+    graph runs reuse warm connections to OpenAI. ChatOpenAI is safe to call from
+    several threads at once.
+    '''
+    # langchain_openai (and the openai SDK) is the slowest import of the app; load it on first use.
+    from langchain_openai import ChatOpenAI
+
+    key = (model, tuple(sorted(kwargs.items())))
+    with _lock:
+        llm = _llms.get(key)
+        if llm is None:
+            # OPENAI_LIMITER retries throttled calls with a backoff shared by every caller;
+            # the SDK's own retries would hide the 429s from it and multiply the attempts.
+            llm = _llms[key] = ChatOpenAI(model=model, http_client=_get_http_client(), **{'max_retries': 0, **kwargs})
+        return llm
@@ -0,0 +1,71 @@
+import hashlib
+import json
+
+from langchain_core.messages import AIMessage, message_to_dict, messages_from_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from agents.cache import TTLCache
+from agents.config import env_bool, env_float, env_int, env_str
+
+# Reuse the tools model's answer when the exact same conversation is sent again.
+LLM_CACHE = env_bool('LLM_CACHE', False)
+LLM_CACHE_SIZE = env_int('LLM_CACHE_SIZE', 256)
+# Seconds a cached answer stays valid, 0 for no expiry.
+LLM_CACHE_TTL = env_float('LLM_CACHE_TTL', 0.0)
+# Also keep answers in this SQLite file, shared by worker processes and kept across restarts.
+LLM_CACHE_PATH = env_str('LLM_CACHE_PATH')
+
+
+def _canonical(message) -> dict:
+    # Only what the model sees: ids, usage and response metadata differ between identical runs.
+    canonical = {'type': message.type, 'content': message.content}
+    if getattr(message, 'name', None):
+        canonical['name'] = message.name
+    if getattr(message, 'tool_calls', None):
+        canonical['tool_calls'] = [{'id': t['id'], 'name': t['name'], 'args': t['args']} for t in message.tool_calls]
+    if getattr(message, 'tool_call_id', None):
+        canonical['tool_call_id'] = message.tool_call_id
+    return canonical
+
+
+def cache_key(model: str, tools: list, messages: list) -> str:
+    '''Hash of the model name, the bound tool schemas and the messages sent.'''
+    payload = {
+        'model': model,
+        'tools': [convert_to_openai_tool(t) for t in tools],
+        'messages': [_canonical(m) for m in messages]
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()
+
+
+class LLMResponseCache:
+    '''Exact-match cache of chat model responses.
+
+    The complete AIMessage, tool_calls included, is stored with message_to_dict in a
+    TTLCache, so replaying a cached tool-calling turn leads to the same tool calls and,
+    with the search cache warm, to the same follow-up requests. Hits are returned without
+    usage_metadata because no tokens were spent on them.
+    '''
+
+    def __init__(self, model: str, tools: list, maxsize: int = LLM_CACHE_SIZE,
+                 ttl: float = LLM_CACHE_TTL, path: str = LLM_CACHE_PATH):
+        self.model = model
+        self.tools = tools
+        self._cache = TTLCache('llm:' + model, ttl=ttl or None, maxsize=maxsize, path=path)
+
+    def key(self, messages: list) -> str:
+        return cache_key(self.model, self.tools, messages)
+
+    def get(self, key: str):
+        data = self._cache.get(key)
+        if data is None:
+            return None
+        message = messages_from_dict([data])[0]
+        # A fresh id: add_messages would otherwise replace an earlier copy in the same thread.
+        return message.copy(update={'usage_metadata': None, 'id': None}) if isinstance(message, AIMessage) else message
+
+    def set(self, key: str, message):
+        self._cache.set(key, message_to_dict(message))
+
+    def stats(self) -> dict:
+        return self._cache.stats()
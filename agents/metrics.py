@@ -0,0 +1,199 @@
+import contextvars
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agents.config import env_int, env_str
+
+# Append every event to this JSONL file.
+METRICS_JSONL_PATH = env_str('METRICS_JSONL_PATH')
+# Serve Prometheus text metrics on this port (GET /metrics).
+METRICS_PORT = env_int('METRICS_PORT', 0)
+# Per-thread aggregates kept in memory, least recently updated threads are dropped first.
+METRICS_MAX_THREADS = env_int('METRICS_MAX_THREADS', 1000)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+current_thread_id = contextvars.ContextVar('current_thread_id', default=None)
+
+
+class InMemorySink:
+    '''Latency histograms, counters and per-thread totals kept in process memory.'''
+
+    def __init__(self, max_threads: int = METRICS_MAX_THREADS):
+        self.max_threads = max_threads
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._threads = OrderedDict()
+
+    def __call__(self, event: dict):
+        key = (event['kind'], event['name'])
+        with self._lock:
+            if 'duration' in event:
+                histogram = self._histograms.setdefault(key, {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+                for i, bound in enumerate(BUCKETS):
+                    if event['duration'] <= bound:
+                        histogram['buckets'][i] += 1
+                histogram['sum'] += event['duration']
+                histogram['count'] += 1
+            for field in ('error', 'prompt_tokens', 'completion_tokens', 'bytes'):
+                value = event.get(field)
+                if value:
+                    self._counters[key + (field,)] = self._counters.get(key + (field,), 0) + (1 if field == 'error' else value)
+            if event['kind'] == 'cache':
+                field = 'hit' if event.get('hit') else 'miss'
+                self._counters[key + (field,)] = self._counters.get(key + (field,), 0) + 1
+            if event.get('thread_id') is not None:
+                self._add_to_thread(event)
+
+    def _add_to_thread(self, event):
+        totals = self._threads.pop(event['thread_id'], None) or {
+            'llm_calls': 0, 'tool_calls': 0, 'http_calls': 0, 'http_time': 0.0, 'prompt_tokens': 0,
+            'completion_tokens': 0, 'payload_bytes': 0, 'iterations': 0, 'errors': 0, 'wall_time': 0.0,
+            'cache_hits': 0
+        }
+        kind = event['kind']
+        if kind == 'llm':
+            totals['llm_calls'] += 1
+        elif kind == 'tool':
+            totals['tool_calls'] += 1
+        elif kind == 'http':
+            totals['http_calls'] += 1
+            totals['http_time'] += event.get('duration', 0.0)
+        elif kind == 'cache':
+            totals['cache_hits'] += 1 if event.get('hit') else 0
+        elif kind == 'node':
+            totals['wall_time'] += event.get('duration', 0.0)
+            totals['iterations'] = max(totals['iterations'], event.get('iteration') or 0)
+        totals['prompt_tokens'] += event.get('prompt_tokens') or 0
+        totals['completion_tokens'] += event.get('completion_tokens') or 0
+        totals['payload_bytes'] += event.get('bytes') or 0
+        totals['errors'] += 1 if event.get('error') else 0
+        self._threads[event['thread_id']] = totals
+        while len(self._threads) > self.max_threads:
+            self._threads.popitem(last=False)
+
+    def thread(self, thread_id: str) -> dict:
+        with self._lock:
+            return dict(self._threads.get(thread_id, {}))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'histograms': {f'{k}:{n}': dict(h, buckets=list(h['buckets'])) for (k, n), h in self._histograms.items()},
+                'counters': {':'.join(key): value for key, value in self._counters.items()}
+            }
+
+    def render_prometheus(self) -> str:
+        lines = ['# TYPE agent_duration_seconds histogram']
+        with self._lock:
+            for (kind, name), histogram in sorted(self._histograms.items()):
+                labels = f'kind="{kind}",name="{name}"'
+                for bound, count in zip(BUCKETS, histogram['buckets']):
+                    lines.append(f'agent_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'agent_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+                lines.append(f'agent_duration_seconds_sum{{{labels}}} {histogram["sum"]}')
+                lines.append(f'agent_duration_seconds_count{{{labels}}} {histogram["count"]}')
+            names = {'error': 'agent_errors_total', 'prompt_tokens': 'agent_prompt_tokens_total',
+                     'completion_tokens': 'agent_completion_tokens_total', 'bytes': 'agent_payload_bytes_total',
+                     'hit': 'agent_cache_hits_total', 'miss': 'agent_cache_misses_total'}
+            for field, metric in names.items():
+                lines.append(f'# TYPE {metric} counter')
+                for (kind, name, counter_field), value in sorted(self._counters.items()):
+                    if counter_field == field:
+                        lines.append(f'{metric}{{kind="{kind}",name="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class JsonlSink:
+    '''Appends every event as one JSON line, e.g. for offline trace analysis.'''
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1)
+
+    def __call__(self, event: dict):
+        line = json.dumps(event, separators=(',', ':'), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+
+class Instrumentation:
+    '''Fan-out of measurement events to pluggable sinks.
+
+    A sink is any callable taking the event dict. Events always carry `kind`
+    ('node', 'tool', 'http', 'llm', 'cache' or 'email'), `name`, `ts` and the `thread_id`
+    of the graph run they belong to, plus whatever was measured: `duration`, `error`,
+    `prompt_tokens`, `completion_tokens`, `bytes`, `iteration`, `hit`, `attempts`.
+    '''
+
+    def __init__(self):
+        self.memory = InMemorySink()
+        self._sinks = [self.memory]
+        self._server = None
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self._sinks.remove(sink)
+
+    def emit(self, kind: str, name: str, **fields):
+        event = {'ts': time.time(), 'kind': kind, 'name': name, 'thread_id': current_thread_id.get(), **fields}
+        for sink in self._sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                print(f'Metrics sink {sink!r} failed: {e}')
+
+    @contextmanager
+    def timed(self, kind: str, name: str, **fields):
+        '''Measure the wall time of the block; the yielded dict can be filled with more fields.'''
+        started = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            self.emit(kind, name, duration=time.perf_counter() - started, **fields)
+
+    def serve(self, port: int, host: str = '0.0.0.0'):
+        '''Expose the in-memory histograms as Prometheus text on http://host:port/metrics.'''
+        if self._server is not None:
+            return self._server
+        memory = self.memory
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = memory.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+        return self._server
+
+
+METRICS = Instrumentation()
+if METRICS_JSONL_PATH:
+    METRICS.add_sink(JsonlSink(METRICS_JSONL_PATH))
+
+
+def llm_usage(message) -> dict:
+    usage = getattr(message, 'usage_metadata', None) or {}
+    return {'prompt_tokens': usage.get('input_tokens', 0), 'completion_tokens': usage.get('output_tokens', 0)}
@@ -0,0 +1,249 @@
+import contextvars
+import datetime
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.cache import make_key
+from agents.config import env_bool, env_float, env_int
+from agents.tools.flights_finder import FlightsInput, flights_params
+from agents.tools.hotels_finder import HotelsInput, hotels_params
+
+PREFETCH_ENABLED = env_bool('PREFETCH_ENABLED', True)
+# Speculative searches started per query (one flight and one hotel search at most).
+PREFETCH_MAX_PER_QUERY = env_int('PREFETCH_MAX_PER_QUERY', 2)
+# Speculative searches running at the same time across all sessions.
+PREFETCH_MAX_IN_FLIGHT = env_int('PREFETCH_MAX_IN_FLIGHT', 8)
+# Stop speculating while more than this share of recent prefetches went unused.
+PREFETCH_MAX_WASTE_RATIO = env_float('PREFETCH_MAX_WASTE_RATIO', 0.5)
+# Unclaimed prefetches are counted as wasted after this many seconds.
+PREFETCH_TTL = env_float('PREFETCH_TTL', 300.0)
+
+# Main airport for cities travellers name instead of an IATA code.
+CITY_AIRPORTS = {
+    'amsterdam': 'AMS', 'athens': 'ATH', 'bangkok': 'BKK', 'barcelona': 'BCN', 'berlin': 'BER',
+    'boston': 'BOS', 'brussels': 'BRU', 'budapest': 'BUD', 'chicago': 'ORD', 'copenhagen': 'CPH',
+    'dubai': 'DXB', 'dublin': 'DUB', 'frankfurt': 'FRA', 'geneva': 'GVA', 'hong kong': 'HKG',
+    'istanbul': 'IST', 'lisbon': 'LIS', 'london': 'LHR', 'los angeles': 'LAX', 'madrid': 'MAD',
+    'miami': 'MIA', 'milan': 'MXP', 'munich': 'MUC', 'new york': 'JFK', 'nice': 'NCE', 'oslo': 'OSL',
+    'paris': 'CDG', 'prague': 'PRG', 'rome': 'FCO', 'san francisco': 'SFO', 'seoul': 'ICN',
+    'singapore': 'SIN', 'stockholm': 'ARN', 'sydney': 'SYD', 'tel aviv': 'TLV', 'tokyo': 'HND',
+    'toronto': 'YYZ', 'venice': 'VCE', 'vienna': 'VIE', 'warsaw': 'WAW', 'zurich': 'ZRH'
+}
+_AIRPORT_CITIES = {code: city for city, code in CITY_AIRPORTS.items()}
+
+_MONTHS = {
+    name: i + 1 for i, names in enumerate((
+        ('january', 'jan'), ('february', 'feb'), ('march', 'mar'), ('april', 'apr'), ('may',),
+        ('june', 'jun'), ('july', 'jul'), ('august', 'aug'), ('september', 'sep', 'sept'),
+        ('october', 'oct'), ('november', 'nov'), ('december', 'dec')
+    )) for name in names
+}
+_MONTH = '(' + '|'.join(sorted(_MONTHS, key=len, reverse=True)) + r')\.?'
+_DAY = r'(\d{1,2})(?:st|nd|rd|th)?'
+_RANGE = r'\s*(?:to|until|till|through|-|–)\s*'
+_ISO_DATE = re.compile(r'\b(\d{4})-(\d{2})-(\d{2})\b')
+_MONTH_FIRST = re.compile(rf'\b{_MONTH}\s+{_DAY}{_RANGE}(?:{_MONTH}\s+)?{_DAY}\b', re.IGNORECASE)
+_DAY_FIRST = re.compile(rf'\b{_DAY}(?:\s+{_MONTH})?{_RANGE}{_DAY}\s+(?:of\s+)?{_MONTH}', re.IGNORECASE)
+_PLACE = re.compile(
+    r'\b(' + '|'.join(sorted(CITY_AIRPORTS, key=len, reverse=True)) + r')\b|\b([A-Z]{3})\b', re.IGNORECASE
+)
+_HOTEL_CLASS = re.compile(r'\b([2-5])[- ]star', re.IGNORECASE)
+_ADULTS = re.compile(r'\b(\d)\s+(?:adults|people|persons|travell?ers)\b', re.IGNORECASE)
+
+
+def _date(year, month, day, today):
+    try:
+        date = datetime.date(year, month, day)
+    except ValueError:
+        return None
+    return date if date >= today else _date(year + 1, month, day, today) if year == today.year else date
+
+
+def parse_dates(text: str, today: datetime.date = None):
+    '''Return (outbound, return) ISO dates found in free text, or (None, None).'''
+    today = today or datetime.date.today()
+    iso = _ISO_DATE.findall(text)
+    if len(iso) >= 2:
+        return '-'.join(iso[0]), '-'.join(iso[1])
+    m = _MONTH_FIRST.search(text)
+    if m:
+        month, day, end_month, end_day = m.groups()
+        start = _date(today.year, _MONTHS[month.lower()], int(day), today)
+        end_month = _MONTHS[end_month.lower()] if end_month else start and start.month
+    else:
+        m = _DAY_FIRST.search(text)
+        if not m:
+            return None, None
+        day, start_month, end_day, end_month = m.groups()
+        end_month = _MONTHS[end_month.lower()]
+        start = _date(today.year, _MONTHS[start_month.lower()] if start_month else end_month, int(day), today)
+    if start is None:
+        return None, None
+    end = _date(start.year, end_month, int(end_day), start)
+    return (start.isoformat(), end.isoformat()) if end else (None, None)
+
+
+def parse_places(text: str):
+    '''Return (departure, arrival) as (IATA code, city name) pairs, either may be None.'''
+    places = []
+    for m in _PLACE.finditer(text):
+        if m.group(1):
+            city = m.group(1)
+            places.append((m.start(), CITY_AIRPORTS[city.lower()], city.title()))
+        elif m.group(2).isupper() and m.group(2) in _AIRPORT_CITIES:
+            code = m.group(2)
+            places.append((m.start(), code, _AIRPORT_CITIES[code].title()))
+    departure = arrival = None
+    for start, code, city in places:
+        before = text[max(0, start - 12):start].lower()
+        if departure is None and re.search(r'\bfrom\s+$', before):
+            departure = (code, city)
+        elif arrival is None and re.search(r'\b(to|visit|in|into)\s+$', before):
+            arrival = (code, city)
+    remaining = [(code, city) for _, code, city in places if (code, city) not in (departure, arrival)]
+    if departure is None and arrival is not None and remaining:
+        departure = remaining[0]
+    elif arrival is None and departure is not None and remaining:
+        arrival = remaining[0]
+    return departure, arrival
+
+
+def guess_tool_calls(text: str, today: datetime.date = None) -> list:
+    '''Tool calls the model is likely to make for a query, built only from the query text.'''
+    outbound, inbound = parse_dates(text, today)
+    if outbound is None:
+        return []
+    departure, arrival = parse_places(text)
+    adults = int(_ADULTS.search(text).group(1)) if _ADULTS.search(text) else 1
+    calls = []
+    if departure and arrival and departure != arrival:
+        calls.append(('flights_finder', {'params': {
+            'departure_airport': departure[0], 'arrival_airport': arrival[0],
+            'outbound_date': outbound, 'return_date': inbound, 'adults': adults
+        }}))
+    if arrival:
+        hotel = {'q': arrival[1], 'check_in_date': outbound, 'check_out_date': inbound, 'adults': adults}
+        hotel_class = _HOTEL_CLASS.search(text)
+        if hotel_class:
+            hotel['hotel_class'] = hotel_class.group(1)
+        calls.append(('hotels_finder', {'params': hotel}))
+    return calls
+
+
+_NORMALIZERS = {
+    'flights_finder': (FlightsInput, flights_params),
+    'hotels_finder': (HotelsInput, hotels_params)
+}
+
+
+def call_key(name: str, args: dict):
+    '''Key identifying the upstream search a tool call performs, or None if unknown.'''
+    if name not in _NORMALIZERS or args.get('params', {}).get('cursor'):
+        return None
+    model, to_params = _NORMALIZERS[name]
+    try:
+        return name + ':' + make_key(to_params(model(**args.get('params', {}))))
+    except Exception:
+        return None
+
+
+class Prefetcher:
+    '''Starts likely searches while the first model call is still running.
+
+    start() parses the user's query locally and submits the guessed tool calls to a
+    small thread pool. When the model's actual tool call normalizes to the same search,
+    claim() hands out the running or finished future instead of searching again.
+    Prefetches that are never claimed count as wasted; while the share of wasted
+    prefetches among the recent ones exceeds `max_waste_ratio`, only every tenth query
+    is speculated on, to find out whether guesses have become useful again.
+    '''
+
+    _WINDOW = 50
+
+    def __init__(self, tools: dict, max_per_query: int = PREFETCH_MAX_PER_QUERY,
+                 max_in_flight: int = PREFETCH_MAX_IN_FLIGHT, max_waste_ratio: float = PREFETCH_MAX_WASTE_RATIO,
+                 ttl: float = PREFETCH_TTL):
+        self._tools = tools
+        self.max_per_query = max_per_query
+        self.max_waste_ratio = max_waste_ratio
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight), thread_name_prefix='prefetch')
+        self._in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._lock = threading.Lock()
+        self._pending = {}  # thread_id -> {key: (future, started_at)}
+        self._outcomes = deque(maxlen=self._WINDOW)  # True = used, False = wasted
+        self._queries = 0
+        self.issued = 0
+        self.used = 0
+        self.wasted = 0
+        self.skipped = 0
+
+    def start(self, thread_id: str, text: str) -> int:
+        self._expire()
+        with self._lock:
+            self._queries += 1
+            if self._throttled() and self._queries % 10:
+                self.skipped += 1
+                return 0
+        self.finish(thread_id)
+        started = 0
+        for name, args in guess_tool_calls(text)[:self.max_per_query]:
+            key = call_key(name, args)
+            if key is None or name not in self._tools or not self._in_flight.acquire(blocking=False):
+                continue
+            future = self._executor.submit(contextvars.copy_context().run, self._run, name, args)
+            with self._lock:
+                self._pending.setdefault(thread_id, {})[key] = (future, time.monotonic())
+                self.issued += 1
+            started += 1
+        if started:
+            print(f'Prefetching {started} search(es) for thread {thread_id}')
+        return started
+
+    def claim(self, thread_id: str, name: str, args: dict):
+        key = call_key(name, args)
+        with self._lock:
+            entry = self._pending.get(thread_id, {}).pop(key, None) if key else None
+            if entry is None:
+                return None
+            self.used += 1
+            self._outcomes.append(True)
+        return entry[0]
+
+    def finish(self, thread_id: str):
+        '''Count the thread's unclaimed prefetches as wasted and forget them.'''
+        with self._lock:
+            leftovers = self._pending.pop(thread_id, {})
+            self.wasted += len(leftovers)
+            self._outcomes.extend([False] * len(leftovers))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'issued': self.issued, 'used': self.used, 'wasted': self.wasted, 'skipped': self.skipped,
+                'pending': sum(len(p) for p in self._pending.values()), 'throttled': self._throttled()
+            }
+
+    def _run(self, name, args):
+        try:
+            return self._tools[name].invoke(args)
+        finally:
+            self._in_flight.release()
+
+    def _throttled(self) -> bool:
+        if len(self._outcomes) < 10:
+            return False
+        return self._outcomes.count(False) / len(self._outcomes) > self.max_waste_ratio
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [
+                thread_id for thread_id, entries in self._pending.items()
+                if all(started < cutoff for _, started in entries.values())
+            ]
+        for thread_id in expired:
+            self.finish(thread_id)
@@ -0,0 +1,95 @@
+import contextlib
+import contextvars
+import threading
+
+from agents.config import env_int
+
+# Maximum number of requests this process may send to each upstream; 0 means unlimited.
+OPENAI_REQUEST_BUDGET = env_int('OPENAI_REQUEST_BUDGET', 0)
+SERPAPI_REQUEST_BUDGET = env_int('SERPAPI_REQUEST_BUDGET', 0)
+
+
+# Refusals of the innermost track() block; context variables follow a run into the
+# threads and tasks its tools are executed on.
+_refused = contextvars.ContextVar('quota_refused', default=None)
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, upstream: str, limit: int):
+        super().__init__(f'{upstream} request budget of {limit} exhausted')
+        self.upstream = upstream
+        self.limit = limit
+
+
+class Quota:
+    '''Global request budget per upstream API, shared by all threads of the process.
+
+    consume() is called right before a request is sent (cache hits are free) and raises
+    QuotaExceeded once the upstream's budget is spent. A limit of None means unlimited.
+    '''
+
+    def __init__(self, limits: dict = None):
+        self._lock = threading.Lock()
+        self._limits = dict(limits or {})
+        self._used = {}
+        self._rejected = {}
+
+    def set_limit(self, upstream: str, limit: int = None):
+        with self._lock:
+            self._limits[upstream] = limit
+
+    def consume(self, upstream: str, n: int = 1):
+        with self._lock:
+            limit = self._limits.get(upstream)
+            used = self._used.get(upstream, 0)
+            if limit is not None and used + n > limit:
+                self._rejected[upstream] = self._rejected.get(upstream, 0) + 1
+                self.note_refusal(upstream)
+                raise QuotaExceeded(upstream, limit)
+            self._used[upstream] = used + n
+
+    def remaining(self, upstream: str):
+        with self._lock:
+            limit = self._limits.get(upstream)
+            return None if limit is None else max(limit - self._used.get(upstream, 0), 0)
+
+    def rejections(self) -> int:
+        '''Requests refused so far by this process, across all threads.'''
+        with self._lock:
+            return sum(self._rejected.values())
+
+    def note_refusal(self, upstream: str):
+        '''Count a refusal for the current track() block, e.g. when the refused request was
+        shared with a concurrent identical one.'''
+        refused = _refused.get()
+        if refused is not None:
+            refused.append(upstream)
+
+    @contextlib.contextmanager
+    def track(self):
+        '''Collect the upstreams of the requests refused inside the block, including those
+        of tool calls on other threads. Tools turn QuotaExceeded into an error result, so
+        this is how a caller learns that its own run was cut short.'''
+        refused = []
+        token = _refused.set(refused)
+        try:
+            yield refused
+        finally:
+            _refused.reset(token)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                upstream: {
+                    'used': self._used.get(upstream, 0),
+                    'limit': self._limits.get(upstream),
+                    'rejected': self._rejected.get(upstream, 0)
+                }
+                for upstream in sorted(set(self._limits) | set(self._used))
+            }
+
+
+QUOTA = Quota({
+    'openai': OPENAI_REQUEST_BUDGET or None,
+    'serpapi': SERPAPI_REQUEST_BUDGET or None
+})
@@ -0,0 +1,326 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+from agents import db
+from agents.config import env_float, env_int, env_str
+
+# Requests per second and burst size per upstream; a rate of 0 (the default) disables the
+# bucket and leaves only adaptive concurrency and Retry-After backoff.
+SERPAPI_RATE = env_float('SERPAPI_RATE', 0.0)
+SERPAPI_BURST = env_int('SERPAPI_BURST', 10)
+SERPAPI_MAX_CONCURRENCY = env_int('SERPAPI_MAX_CONCURRENCY', 16)
+OPENAI_RATE = env_float('OPENAI_RATE', 0.0)
+OPENAI_BURST = env_int('OPENAI_BURST', 20)
+OPENAI_MAX_CONCURRENCY = env_int('OPENAI_MAX_CONCURRENCY', 32)
+# Share the token buckets between worker processes through this SQLite file.
+RATE_LIMIT_DB = env_str('RATE_LIMIT_DB')
+# Seconds a caller queues (waiting for tokens, slots or a Retry-After) before the error is returned.
+RATE_LIMIT_MAX_WAIT = env_float('RATE_LIMIT_MAX_WAIT', 30.0)
+# First backoff when a throttled response carries no Retry-After; doubled on every retry.
+RATE_LIMIT_BACKOFF = env_float('RATE_LIMIT_BACKOFF', 1.0)
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def retry_after(response) -> float:
+    '''Seconds to wait according to a response's Retry-After (or OpenAI's retry-after-ms) header.'''
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        date = email.utils.parsedate_to_datetime(value) if email.utils.parsedate_tz(value) else None
+        return max(date.timestamp() - time.time(), 0.0) if date else None
+
+
+def throttle_delay(error: Exception):
+    '''(throttled, delay) for an exception raised by an upstream call.
+
+    Works for SerpApiError and the openai client's APIStatusError alike: both carry the
+    HTTP response, whose status says whether the upstream throttled us and whose headers
+    may say for how long.
+    '''
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if status not in THROTTLE_STATUSES:
+        return False, None
+    return True, retry_after(response)
+
+
+class TokenBucket:
+    '''In-process token bucket: `rate` tokens per second, at most `burst` saved up.'''
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        '''Take a token and return 0, or return the seconds until one may be available.'''
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.rate <= 0:
+                return 0.0
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class SqliteTokenBucket:
+    '''Token bucket whose state lives in SQLite, so every process using the file shares it.'''
+
+    def __init__(self, name: str, rate: float, burst: int, path: str):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._conn = db.connect(path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limits ('
+            'name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, paused_until REAL NOT NULL)'
+        )
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.time()
+            # BEGIN IMMEDIATE takes the write lock, so the read-modify-write is atomic across processes.
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT tokens, updated_at, paused_until FROM rate_limits WHERE name = ?', (self.name,)
+                ).fetchone()
+                tokens, updated, paused_until = row if row else (float(self.burst), now, 0.0)
+                if now < paused_until:
+                    wait = paused_until - now
+                elif self.rate <= 0:
+                    wait = 0.0
+                else:
+                    tokens = min(self.burst, tokens + max(now - updated, 0.0) * self.rate)
+                    wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                    tokens -= 1 if tokens >= 1 else 0
+                    updated = now
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at, paused_until) VALUES (?, ?, ?, ?)',
+                    (self.name, tokens, updated, paused_until)
+                )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            return wait
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO rate_limits (name, tokens, updated_at, paused_until) VALUES (?, 0, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET paused_until = MAX(paused_until, excluded.paused_until)',
+                (self.name, time.time(), time.time() + seconds)
+            )
+
+
+class AIMDLimiter:
+    '''Concurrency limit that grows by one per window of successes and halves when throttled.
+
+    Threads and coroutines share the limit. release() wakes waiting threads through the
+    condition and waiting coroutines through a future on their own event loop, since
+    one limiter serves every thread and loop of the process.
+    '''
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial: int = None):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial or self.max_limit)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._waiters = []
+
+    async def aacquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # The waiter's event loop is closed; nobody is waiting there any more.
+                pass
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class RateLimiter:
+    '''Token bucket, adaptive concurrency and Retry-After backoff for one upstream API.
+
+    call()/acall() queue the caller until the bucket has a token and a concurrency slot
+    is free, then run the request. When the upstream throttles (429/503), the whole
+    bucket is paused for the Retry-After the response asked for (or an exponential
+    backoff), the concurrency limit is halved and the request is retried. Callers give
+    up after `max_wait` seconds of queueing and get the last error.
+    '''
+
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int,
+                 path: str = None, max_wait: float = RATE_LIMIT_MAX_WAIT, backoff: float = RATE_LIMIT_BACKOFF):
+        self.name = name
+        self.bucket = SqliteTokenBucket(name, rate, burst, path) if path else TokenBucket(rate, burst)
+        self.concurrency = AIMDLimiter(max_concurrency)
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self.throttled = 0
+
+    def call(self, fn):
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            self._wait_for_token(deadline)
+            if not self.concurrency.acquire(max(deadline - time.monotonic(), 0.0)):
+                raise RateLimitTimeout(f'{self.name}: no request slot free within {self.max_wait:g}s')
+            throttled = False
+            try:
+                return fn()
+            except Exception as e:
+                throttled, delay = throttle_delay(e)
+                if not throttled:
+                    raise
+                delay = self._on_throttle(delay, attempt)
+                self.bucket.pause(delay)
+                if time.monotonic() + delay > deadline:
+                    raise
+            finally:
+                self.concurrency.release(throttled)
+            attempt += 1
+            time.sleep(delay)
+
+    async def acall(self, coro_fn):
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            await self._await_token(deadline)
+            if not await self.concurrency.aacquire(max(deadline - time.monotonic(), 0.0)):
+                raise RateLimitTimeout(f'{self.name}: no request slot free within {self.max_wait:g}s')
+            throttled = False
+            try:
+                return await coro_fn()
+            except Exception as e:
+                throttled, delay = throttle_delay(e)
+                if not throttled:
+                    raise
+                delay = self._on_throttle(delay, attempt)
+                await self._off_loop(self.bucket.pause, delay)
+                if time.monotonic() + delay > deadline:
+                    raise
+            finally:
+                self.concurrency.release(throttled)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            'name': self.name,
+            'concurrency_limit': int(self.concurrency.limit),
+            'in_flight': self.concurrency.in_flight,
+            'throttled': self.throttled
+        }
+
+    def _on_throttle(self, delay, attempt) -> float:
+        self.throttled += 1
+        if delay is None:
+            delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+        print(f'{self.name} throttled, retrying in {delay:.2f}s')
+        return delay
+
+    async def _off_loop(self, fn, *args):
+        '''Run a bucket method, in a worker thread when it blocks on the shared SQLite file.'''
+        if isinstance(self.bucket, SqliteTokenBucket):
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def _wait_for_token(self, deadline):
+        while True:
+            wait = self.bucket.reserve()
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f'{self.name}: rate limit would delay the request beyond {self.max_wait:g}s')
+            time.sleep(wait)
+
+    async def _await_token(self, deadline):
+        while True:
+            # BEGIN IMMEDIATE may wait for another process's lock; don't stall the event loop.
+            wait = await self._off_loop(self.bucket.reserve)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f'{self.name}: rate limit would delay the request beyond {self.max_wait:g}s')
+            await asyncio.sleep(wait)
+
+
+SERPAPI_LIMITER = RateLimiter('serpapi', SERPAPI_RATE, SERPAPI_BURST, SERPAPI_MAX_CONCURRENCY, RATE_LIMIT_DB)
+OPENAI_LIMITER = RateLimiter('openai', OPENAI_RATE, OPENAI_BURST, OPENAI_MAX_CONCURRENCY, RATE_LIMIT_DB)
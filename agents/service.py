@@ -0,0 +1,373 @@
+'''Local agent worker service.
+
+The front-end only queues jobs in a SQLite file and reads their events back; a pool of
+worker processes runs the agent graph:
+
+    python -m agents.service --workers 4     # start the workers
+    AGENT_SERVICE=true streamlit run app.py  # the UI submits jobs instead of planning in-process
+
+A 'plan' job streams the same ('progress' | 'token' | 'reset', value) events as
+Agent.stream_plan into the events table, where AgentService.stream() picks them up by
+job id, and stops before email_sender like an in-process run. The 'email' job resumes
+the thread's interrupted run, so the human-in-the-loop step goes through the same queue.
+Jobs of one thread never run at the same time, and all workers share the checkpointer,
+so any worker can resume any thread.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+
+from agents import db
+from agents.config import env_bool, env_float, env_int, env_str
+
+# Let the Streamlit app hand planning to the worker service instead of running the graph itself.
+AGENT_SERVICE = env_bool('AGENT_SERVICE', False)
+SERVICE_DB = env_str('SERVICE_DB', 'service.sqlite')
+SERVICE_WORKERS = env_int('SERVICE_WORKERS', os.cpu_count() or 2)
+# Jobs each worker process runs at the same time; planning mostly waits on OpenAI and SerpAPI.
+SERVICE_WORKER_THREADS = env_int('SERVICE_WORKER_THREADS', 4)
+# Seconds between polls of the queue by idle workers and of the event log by clients.
+SERVICE_POLL_INTERVAL = env_float('SERVICE_POLL_INTERVAL', 0.2)
+# Finished jobs and their events are deleted after this many seconds.
+SERVICE_JOB_TTL = env_float('SERVICE_JOB_TTL', 3600.0)
+
+# Workers record that they are alive this often; a client waiting on a queued job gives up
+# when no worker has done so for WORKER_TIMEOUT seconds.
+HEARTBEAT_INTERVAL = 2.0
+WORKER_TIMEOUT = 10.0
+# Consecutive tokens are written as one event at most this often.
+TOKEN_FLUSH_INTERVAL = 0.1
+
+
+class ServiceError(Exception):
+    pass
+
+
+class JobQueue:
+    '''Jobs, their event log and worker heartbeats in one SQLite file.
+
+    Every process opens its own JobQueue; the connection is shared by the threads of the
+    process under a lock, and claim() takes SQLite's write lock so two workers never
+    get the same job.
+    '''
+
+    def __init__(self, path: str = SERVICE_DB):
+        self._lock = threading.Lock()
+        self._conn = db.connect(path)
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, kind TEXT NOT NULL, payload TEXT NOT NULL, '
+            'status TEXT NOT NULL, worker INTEGER, result TEXT, error TEXT, '
+            'created_at REAL NOT NULL, started_at REAL, finished_at REAL);'
+            'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);'
+            'CREATE TABLE IF NOT EXISTS job_events ('
+            'job_id TEXT NOT NULL, seq INTEGER NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL, '
+            'PRIMARY KEY (job_id, seq));'
+            'CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, seen_at REAL NOT NULL);'
+        )
+
+    def submit(self, kind: str, thread_id: str, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, thread_id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, thread_id, kind, json.dumps(payload), time.time())
+            )
+        return job_id
+
+    def claim(self, worker: int):
+        '''Mark the oldest queued job whose thread is idle as running and return it, or None.'''
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    "SELECT id, thread_id, kind, payload FROM jobs WHERE status = 'queued' AND thread_id NOT IN "
+                    "(SELECT thread_id FROM jobs WHERE status = 'running') ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ? WHERE id = ?",
+                        (worker, time.time(), row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return {'id': row[0], 'thread_id': row[1], 'kind': row[2], 'payload': json.loads(row[3])}
+
+    def append(self, job_id: str, events: list):
+        with self._lock:
+            seq = self._conn.execute(
+                'SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?', (job_id,)
+            ).fetchone()[0]
+            self._conn.executemany(
+                'INSERT INTO job_events (job_id, seq, kind, value) VALUES (?, ?, ?, ?)',
+                [(job_id, seq + i, kind, value) for i, (kind, value) in enumerate(events, 1)]
+            )
+
+    def finish(self, job_id: str, result: dict = None, error: str = None):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+                ('error' if error else 'done', json.dumps(result, default=str), error, time.time(), job_id)
+            )
+
+    def events(self, job_id: str, after: int = 0) -> list:
+        '''(seq, kind, value) of the job's events after `after`, oldest first.'''
+        with self._lock:
+            return self._conn.execute(
+                'SELECT seq, kind, value FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq', (job_id, after)
+            ).fetchall()
+
+    def job(self, job_id: str) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, thread_id, kind, status, result, error FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0], 'thread_id': row[1], 'kind': row[2], 'status': row[3],
+            'result': json.loads(row[4]) if row[4] else None, 'error': row[5]
+        }
+
+    def heartbeat(self, worker: int):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO workers (pid, seen_at) VALUES (?, ?)', (worker, time.time()))
+
+    def live_workers(self, max_age: float = WORKER_TIMEOUT) -> int:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM workers WHERE seen_at >= ?', (time.time() - max_age,)
+            ).fetchone()[0]
+
+    def busy_workers(self) -> list:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT worker FROM jobs WHERE status = 'running'")]
+
+    def fail_worker(self, worker: int, error: str) -> int:
+        '''Fail the running jobs of a worker that is gone, returning how many there were.'''
+        with self._lock:
+            self._conn.execute('DELETE FROM workers WHERE pid = ?', (worker,))
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'error', error = ?, finished_at = ? WHERE status = 'running' AND worker = ?",
+                (error, time.time(), worker)
+            ).rowcount
+
+    def prune(self, ttl: float = SERVICE_JOB_TTL) -> int:
+        '''Delete jobs (and their events) that finished more than `ttl` seconds ago.'''
+        with self._lock:
+            cutoff = time.time() - ttl
+            self._conn.execute(
+                'DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)', (cutoff,)
+            )
+            return self._conn.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,)).rowcount
+
+
+class AgentService:
+    '''Client side of the service, used by the front-end.
+
+    plan() and send_email() queue a job and return its id; stream() yields the job's
+    events as the worker writes them and returns once the job is done.
+    '''
+
+    def __init__(self, path: str = SERVICE_DB, poll_interval: float = SERVICE_POLL_INTERVAL):
+        self.queue = JobQueue(path)
+        self.poll_interval = poll_interval
+
+    def plan(self, thread_id: str, query: str, **configurable) -> str:
+        return self.queue.submit('plan', thread_id, {'query': query, 'configurable': configurable})
+
+    def send_email(self, thread_id: str, to_email: str, subject: str, from_email: str = None) -> str:
+        configurable = {'to_email': to_email, 'email_subject': subject, 'from_email': from_email}
+        return self.queue.submit('email', thread_id, {'configurable': {k: v for k, v in configurable.items() if v}})
+
+    def stream(self, job_id: str, after: int = 0):
+        '''Yield the job's (kind, value) events; raises ServiceError if the job fails.'''
+        waited_since = time.monotonic()
+        while True:
+            # Status first: events written before the job finished are read below.
+            job = self.queue.job(job_id)
+            if job is None:
+                raise ServiceError(f'Unknown job {job_id}')
+            events = self.queue.events(job_id, after)
+            for seq, kind, value in events:
+                after = seq
+                yield kind, value
+            if events:
+                continue
+            if job['status'] == 'error':
+                raise ServiceError(job['error'])
+            if job['status'] == 'done':
+                return
+            if job['status'] == 'queued' and time.monotonic() - waited_since > WORKER_TIMEOUT:
+                if not self.queue.live_workers():
+                    raise ServiceError('No agent workers are running; start them with `python -m agents.service`')
+                waited_since = time.monotonic()
+            time.sleep(self.poll_interval)
+
+    def wait(self, job_id: str) -> dict:
+        '''Block until the job is done and return its result.'''
+        for _ in self.stream(job_id):
+            pass
+        return self.queue.job(job_id)['result']
+
+
+class _EventWriter:
+    '''Appends a job's events, merging consecutive tokens to keep the number of writes low.'''
+
+    def __init__(self, queue: JobQueue, job_id: str):
+        self._queue = queue
+        self._job_id = job_id
+        self._tokens = ''
+        self._flushed_at = time.monotonic()
+
+    def add(self, kind: str, value: str):
+        if kind == 'token':
+            self._tokens += value
+            if time.monotonic() - self._flushed_at >= TOKEN_FLUSH_INTERVAL:
+                self.flush()
+            return
+        self.flush([(kind, value)])
+
+    def flush(self, events: list = ()):
+        events = ([('token', self._tokens)] if self._tokens else []) + list(events)
+        self._tokens = ''
+        self._flushed_at = time.monotonic()
+        if events:
+            self._queue.append(self._job_id, events)
+
+
+def run_job(agent, queue: JobQueue, job: dict):
+    from langchain_core.messages import HumanMessage
+
+    config = {'configurable': {**job['payload'].get('configurable', {}), 'thread_id': job['thread_id']}}
+    try:
+        if job['kind'] == 'plan':
+            writer = _EventWriter(queue, job['id'])
+            for kind, value in agent.stream_plan({'messages': [HumanMessage(content=job['payload']['query'])]}, config):
+                writer.add(kind, value)
+            writer.flush()
+            values = agent.graph.get_state(config).values
+            result = {'plan': values['messages'][-1].content, 'budget': values.get('budget')}
+        elif job['kind'] == 'email':
+            agent.graph.invoke(None, config)
+            result = {}
+        else:
+            raise ValueError(f'Unknown job kind {job["kind"]!r}')
+    except Exception as e:
+        print(f'Job {job["id"]} ({job["kind"]}) failed: {e}')
+        queue.finish(job['id'], error=f'{type(e).__name__}: {e}')
+    else:
+        queue.finish(job['id'], result=result)
+
+
+def worker_main(path: str, threads: int, poll_interval: float):
+    '''Entry point of a worker process: run jobs on `threads` threads until SIGTERM.'''
+    from agents.agent import get_agent
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    agent = get_agent()
+    queue = JobQueue(path)
+    pid = os.getpid()
+
+    def work():
+        while not stop.is_set():
+            job = queue.claim(pid)
+            if job is None:
+                stop.wait(poll_interval)
+            else:
+                run_job(agent, queue, job)
+
+    pool = [threading.Thread(target=work, name=f'service-{i}', daemon=True) for i in range(max(1, threads))]
+    for thread in pool:
+        thread.start()
+    queue.heartbeat(pid)
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        queue.heartbeat(pid)
+    # Running jobs are finished before the process exits, and so are queued emails.
+    for thread in pool:
+        thread.join()
+    agent._email_queue.join()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def serve(path: str = SERVICE_DB, workers: int = SERVICE_WORKERS, threads: int = SERVICE_WORKER_THREADS,
+          poll_interval: float = SERVICE_POLL_INTERVAL):
+    '''Run `workers` worker processes until interrupted, replacing any that die.
+
+    Jobs a dead worker was running are failed rather than retried: a plan may have
+    spent its request budget and an email may already have been queued.
+    '''
+    # spawn, not fork: the parent's threads and open connections must not be copied.
+    from agents.checkpointer import CHECKPOINTER
+
+    if CHECKPOINTER == 'memory' and workers > 1:
+        print('Warning: CHECKPOINTER=memory keeps threads inside one worker, emails may not find their plan')
+    context = multiprocessing.get_context('spawn')
+    queue = JobQueue(path)
+    for worker in queue.busy_workers():
+        if not _alive(worker):
+            queue.fail_worker(worker, 'The worker running this job stopped')
+
+    def start():
+        process = context.Process(target=worker_main, args=(path, threads, poll_interval), daemon=False)
+        process.start()
+        return process
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    processes = [start() for _ in range(max(1, workers))]
+    print(f'Agent service: {len(processes)} workers x {threads} threads on {path}')
+    last_prune = 0.0
+    try:
+        while not stop.wait(1.0):
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    failed = queue.fail_worker(process.pid, 'The worker running this job stopped')
+                    print(f'Worker {process.pid} exited with {process.exitcode}, {failed} job(s) failed; restarting')
+                    processes[i] = start()
+            if time.monotonic() - last_prune >= 60:
+                queue.prune()
+                last_prune = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=SERVICE_DB, help='SQLite file holding the jobs (default: $SERVICE_DB)')
+    parser.add_argument('--workers', type=int, default=SERVICE_WORKERS, help='worker processes')
+    parser.add_argument('--threads', type=int, default=SERVICE_WORKER_THREADS, help='jobs run at once per worker')
+    args = parser.parse_args(argv)
+    serve(args.db, args.workers, args.threads)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import weakref
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''Collapse identical concurrent calls into one.
+
+    The first caller for a key runs the function; callers that arrive while it is in
+    flight wait for it and receive the same result or the same exception. The key is
+    forgotten as soon as the call finishes, so nothing is retained afterwards and the
+    next call for the key goes upstream again (or hits a cache in front of this layer).
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # asyncio tasks belong to one event loop, so in-flight async calls are tracked per loop.
+        self._async_calls = weakref.WeakKeyDictionary()
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+    async def ado(self, key, coro_fn):
+        calls = self._async_calls.setdefault(asyncio.get_running_loop(), {})
+        task = calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            calls[key] = task
+            task.add_done_callback(lambda t: self._forget(calls, key, t))
+        else:
+            self.shared += 1
+        # shield(): a caller that is cancelled (e.g. by a timeout) must not cancel the
+        # upstream request the other waiters are still interested in.
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _forget(calls, key, task):
+        if calls.get(key) is task:
+            del calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away.
+            task.exception()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + sum(len(calls) for calls in self._async_calls.values())
@@ -1,10 +1,14 @@
-import os
-from typing import Optional
+from typing import Optional, TypedDict
 
 # from pydantic import BaseModel, Field
-import serpapi
 from langchain.pydantic_v1 import BaseModel, Field
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool
+
+from agents.config import env_int
+from agents.tools import serpapi_client
+
+# Number of flight options handed back to the model.
+FLIGHTS_RESULT_LIMIT = env_int('FLIGHTS_RESULT_LIMIT', 5)
 
 
 class FlightsInput(BaseModel):
@@ -22,17 +26,29 @@ class FlightsInputSchema(BaseModel):
     params: FlightsInput
 
 
-@tool(args_schema=FlightsInputSchema)
-def flights_finder(params: FlightsInput):
-    '''
-    Find flights using the Google Flights engine.
+class FlightLeg(TypedDict):
+    from_airport: str
+    to_airport: str
+    departure: str
+    arrival: str
+    airline: str
+    flight_number: str
+    duration: int
+
+
+class FlightOption(TypedDict, total=False):
+    legs: list[FlightLeg]
+    airline: str
+    airline_logo: str
+    stops: int
+    total_duration: int
+    price: int
+    type: str
+    booking_token: str
 
-    Returns:
-        dict: Flight search results.
-    '''
 
-    params = {
-        'api_key': os.environ.get('SERPAPI_API_KEY'),
+def flights_params(params: FlightsInput) -> dict:
+    return {
         'engine': 'google_flights',
         'hl': 'en',
         'gl': 'us',
@@ -48,9 +64,74 @@ def flights_finder(params: FlightsInput):
         'children': params.children
     }
 
+
+def _leg(flight: dict) -> FlightLeg:
+    departure = flight.get('departure_airport', {})
+    arrival = flight.get('arrival_airport', {})
+    return {
+        'from_airport': departure.get('id'),
+        'to_airport': arrival.get('id'),
+        'departure': departure.get('time'),
+        'arrival': arrival.get('time'),
+        'airline': flight.get('airline'),
+        'flight_number': flight.get('flight_number'),
+        'duration': flight.get('duration')
+    }
+
+
+def compact_flights(data: dict, limit: int = None) -> list[FlightOption]:
+    '''Project a Google Flights response onto the few fields the travel plan needs.
+
+    The raw options also carry carbon data, amenities, legroom and airport names the
+    model never uses and that would be re-sent with the history on every turn.
+    '''
+    limit = FLIGHTS_RESULT_LIMIT if limit is None else limit
+    options = data.get('best_flights', []) + data.get('other_flights', [])
+    compacted = []
+    for option in options[:limit]:
+        legs = [_leg(flight) for flight in option.get('flights', [])]
+        compacted_option = {
+            'legs': legs,
+            'airline': legs[0]['airline'] if legs else None,
+            'airline_logo': option.get('airline_logo'),
+            'stops': max(len(legs) - 1, 0),
+            'total_duration': option.get('total_duration'),
+            'price': option.get('price'),
+            'type': option.get('type'),
+            # Round trips only carry a departure_token until the return flight is chosen.
+            'booking_token': option.get('booking_token') or option.get('departure_token')
+        }
+        compacted.append({k: v for k, v in compacted_option.items() if v is not None})
+    return compacted
+
+
+def _find_flights(params: FlightsInput):
+    '''
+    Find flights using the Google Flights engine.
+
+    Returns:
+        list: Top flight options with legs, airline, times, stops, duration, price and booking token.
+    '''
+    try:
+        data = serpapi_client.search(flights_params(params), cache=serpapi_client.FLIGHTS_CACHE)
+        results = compact_flights(data)
+    except Exception as e:
+        results = str(e)
+    return results
+
+
+async def _afind_flights(params: FlightsInput):
     try:
-        search = serpapi.search(params)
-        results = search.data['best_flights']
+        data = await serpapi_client.asearch(flights_params(params), cache=serpapi_client.FLIGHTS_CACHE)
+        results = compact_flights(data)
     except Exception as e:
         results = str(e)
     return results
+
+
+flights_finder = StructuredTool.from_function(
+    func=_find_flights,
+    coroutine=_afind_flights,
+    name='flights_finder',
+    args_schema=FlightsInputSchema
+)
@@ -1,9 +1,68 @@
-import os
+import json
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
-import serpapi
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool
 from pydantic import BaseModel, Field
 
+from agents.cache import make_key
+from agents.config import env_float, env_int
+from agents.tools import serpapi_client
+
+# Hotels returned per call; the rest of the page is kept for follow-up calls with the cursor.
+HOTELS_PAGE_SIZE = env_int('HOTELS_PAGE_SIZE', 5)
+# Pages with hotels still to return are kept this long, up to this many bytes (JSON-encoded)
+# in total, least recently used first out; 0 bytes disables it and refetches every page.
+HOTELS_PAGE_TTL = env_float('HOTELS_PAGE_TTL', 900.0)
+HOTELS_PAGES_MAX_BYTES = env_int('HOTELS_PAGES_MAX_BYTES', 2 * 1024 * 1024)
+
+
+class _PageStore:
+    '''Processed hotel pages by search, bounded by age and total encoded size.
+
+    Independent of the search cache, so paging through a page never sends a second
+    SerpAPI request for it, even with SEARCH_CACHE_SIZE=0.
+    '''
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                return None
+            page, size, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._drop(key)
+                return None
+            self._pages.move_to_end(key)
+            return page
+
+    def set(self, key: str, page: dict):
+        size = len(json.dumps(page, separators=(',', ':')))
+        with self._lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._pages[key] = (page, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._pages)))
+
+    def _drop(self, key: str):
+        entry = self._pages.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+HOTEL_PAGES = _PageStore(HOTELS_PAGE_TTL, HOTELS_PAGES_MAX_BYTES)
+
 class HotelsInput(BaseModel):
     q: str = Field(description='Location of the hotel')
     check_in_date: str = Field(description='Check-in date. The format is YYYY-MM-DD. e.g. 2024-06-22')
@@ -13,65 +72,140 @@ class HotelsInput(BaseModel):
     children: Optional[int] = Field(default=0, description='Number of children. Default to 0.')
     rooms: Optional[int] = Field(default=1, description='Number of rooms. Default to 1.')
     hotel_class: Optional[str] = Field(default=None, description='Parameter defines to include only certain hotel class in the results. for example- 2,3,4')
+    cursor: Optional[str] = Field(default=None, description='To get more hotels for the same search, pass the next_cursor returned by the previous call')
 
 class HotelsInputSchema(BaseModel):
     params: HotelsInput
 
-@tool(args_schema=HotelsInputSchema)
-def hotels_finder(params: HotelsInput):
+def hotels_params(params: HotelsInput) -> dict:
+    search_params = {
+        'engine': 'google_hotels',
+        'hl': 'en',
+        'gl': 'us',
+        'q': params.q,
+        'check_in_date': params.check_in_date,
+        'check_out_date': params.check_out_date,
+        'currency': 'USD',
+        'adults': params.adults,
+        'children': params.children,
+        'rooms': params.rooms,
+        'sort_by': params.sort_by
+    }
+
+    # Add hotel class if specified
+    if params.hotel_class:
+        search_params['hotel_class'] = params.hotel_class
+    return search_params
+
+
+def _process_hotels(data: dict) -> list:
+    # Process and extract results
+    raw_properties = data.get('properties', [])
+    
+    # Process and clean up hotel information
+    processed_hotels = []
+    for hotel in raw_properties:
+        processed_hotel = {
+            'name': hotel.get('name', 'Unknown Hotel'),
+            'price': hotel.get('price', 'Price not available'),
+            'rating': hotel.get('rating', 'No rating'),
+            'reviews_count': hotel.get('reviews_count', 'No reviews'),
+            'description': hotel.get('description', 'No description'),
+            'amenities': hotel.get('amenities', []),
+            'link': hotel.get('link', ''),
+            'image': hotel.get('thumbnail', '')
+        }
+        processed_hotels.append(processed_hotel)
+    
+    return processed_hotels
+
+
+def _page_params(params: HotelsInput, token: str) -> dict:
+    search_params = hotels_params(params)
+    if token:
+        search_params['next_page_token'] = token
+    return search_params
+
+
+def _page(data: dict) -> dict:
+    return {
+        'hotels': _process_hotels(data),
+        'next_page_token': data.get('serpapi_pagination', {}).get('next_page_token')
+    }
+
+
+def _parse_cursor(cursor: str):
+    # A cursor is '<offset>:<SerpAPI next_page_token of the page, empty for the first page>'.
+    offset, _, token = (cursor or '0:').partition(':')
+    return int(offset) if offset.isdigit() else 0, token or None
+
+
+def _keep(key: str, page: dict, offset: int):
+    # Only pages with hotels left for follow-up calls are worth keeping.
+    if len(page['hotels']) > offset + HOTELS_PAGE_SIZE:
+        HOTEL_PAGES.set(key, page)
+
+
+def _result(page: dict, offset: int, token: str) -> dict:
+    hotels = page['hotels'][offset:offset + HOTELS_PAGE_SIZE]
+    end = offset + len(hotels)
+    if end < len(page['hotels']):
+        next_cursor = f'{end}:{token or ""}'
+    elif page['next_page_token']:
+        next_cursor = f'0:{page["next_page_token"]}'
+    else:
+        next_cursor = None
+    return {'hotels': hotels, 'next_cursor': next_cursor}
+
+
+def _search_error(e: Exception, params: HotelsInput) -> dict:
+    # Improved error handling
+    return {
+        'error': f"Error in hotel search: {str(e)}",
+        'params': str(hotels_params(params))
+    }
+
+
+def _find_hotels(params: HotelsInput):
     '''
     Find hotels using the Google Hotels engine.
     
     Returns:
-        list: Top 5 hotel search results with processed information.
+        dict: The top hotels with processed information and a next_cursor for more results
+        (null when there are none).
     '''
     try:
-        # Prepare search parameters
-        search_params = {
-            'api_key': os.environ.get('SERPAPI_API_KEY'),
-            'engine': 'google_hotels',
-            'hl': 'en',
-            'gl': 'us',
-            'q': params.q,
-            'check_in_date': params.check_in_date,
-            'check_out_date': params.check_out_date,
-            'currency': 'USD',
-            'adults': params.adults,
-            'children': params.children,
-            'rooms': params.rooms,
-            'sort_by': params.sort_by
-        }
+        offset, token = _parse_cursor(params.cursor)
+        search_params = _page_params(params, token)
+        key = make_key(search_params)
+        # Follow-up calls within a page are answered from HOTEL_PAGES; once the page is
+        # used up the cursor carries SerpAPI's next_page_token.
+        page = HOTEL_PAGES.get(key) if offset else None
+        if page is None:
+            page = _page(serpapi_client.search(search_params, cache=serpapi_client.HOTELS_CACHE))
+            _keep(key, page, offset)
+        return _result(page, offset, token)
+    except Exception as e:
+        return _search_error(e, params)
 
-        # Add hotel class if specified
-        if params.hotel_class:
-            search_params['hotel_class'] = params.hotel_class
-
-        # Perform search
-        search = serpapi.search(search_params)
-        
-        # Process and extract results
-        raw_properties = search.data.get('properties', [])
-        
-        # Process and clean up hotel information
-        processed_hotels = []
-        for hotel in raw_properties[:5]:
-            processed_hotel = {
-                'name': hotel.get('name', 'Unknown Hotel'),
-                'price': hotel.get('price', 'Price not available'),
-                'rating': hotel.get('rating', 'No rating'),
-                'reviews_count': hotel.get('reviews_count', 'No reviews'),
-                'description': hotel.get('description', 'No description'),
-                'amenities': hotel.get('amenities', []),
-                'link': hotel.get('link', ''),
-                'image': hotel.get('thumbnail', '')
-            }
-            processed_hotels.append(processed_hotel)
-        
-        return processed_hotels
 
+async def _afind_hotels(params: HotelsInput):
+    try:
+        offset, token = _parse_cursor(params.cursor)
+        search_params = _page_params(params, token)
+        key = make_key(search_params)
+        page = HOTEL_PAGES.get(key) if offset else None
+        if page is None:
+            page = _page(await serpapi_client.asearch(search_params, cache=serpapi_client.HOTELS_CACHE))
+            _keep(key, page, offset)
+        return _result(page, offset, token)
     except Exception as e:
-        # Improved error handling
-        return {
-            'error': f"Error in hotel search: {str(e)}",
-            'params': str(search_params)
-        }
\ No newline at end of file
+        return _search_error(e, params)
+
+
+hotels_finder = StructuredTool.from_function(
+    func=_find_hotels,
+    coroutine=_afind_hotels,
+    name='hotels_finder',
+    args_schema=HotelsInputSchema
+)
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import httpx
+
+from agents.cache import TTLCache, make_key
+from agents.config import env_float, env_int, env_str
+from agents.metrics import METRICS, current_thread_id
+from agents.quota import QUOTA, QuotaExceeded
+from agents.ratelimit import SERPAPI_LIMITER
+from agents.singleflight import SingleFlight
+
+SERPAPI_BASE_URL = env_str('SERPAPI_BASE_URL', 'https://serpapi.com')
+SERPAPI_TIMEOUT = env_float('SERPAPI_TIMEOUT', 30.0)
+SERPAPI_MAX_CONNECTIONS = env_int('SERPAPI_MAX_CONNECTIONS', 20)
+
+# Search results are cached per engine: flight prices go stale faster than hotel listings.
+SEARCH_CACHE_SIZE = env_int('SEARCH_CACHE_SIZE', 128)
+SEARCH_CACHE_PATH = env_str('SEARCH_CACHE_PATH')
+FLIGHTS_CACHE = TTLCache('google_flights', ttl=env_float('FLIGHTS_CACHE_TTL', 600.0),
+                         maxsize=SEARCH_CACHE_SIZE, path=SEARCH_CACHE_PATH)
+HOTELS_CACHE = TTLCache('google_hotels', ttl=env_float('HOTELS_CACHE_TTL', 3600.0),
+                        maxsize=SEARCH_CACHE_SIZE, path=SEARCH_CACHE_PATH)
+
+# Identical searches that are in flight at the same time share one upstream request.
+IN_FLIGHT = SingleFlight()
+
+# Upstream requests per running graph thread that are not yet charged to the run's
+# SerpAPI budget; the agent takes them after every node. Only runs between begin_run()
+# and end_run() are counted, and runs that never end (a failed node) are dropped oldest
+# first beyond _MAX_RUNS.
+_run_calls = OrderedDict()
+_run_calls_lock = threading.Lock()
+_MAX_RUNS = 10000
+# Requests the running tool calls may still make, None when the run has no SerpAPI budget.
+_allowance = contextvars.ContextVar('serpapi_allowance', default=None)
+
+_client = None
+_client_lock = threading.Lock()
+# httpx.AsyncClient is bound to the event loop it was first used on, so keep one per loop.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class SerpApiError(Exception):
+    def __init__(self, message, status_code=None, response=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = response
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=SERPAPI_MAX_CONNECTIONS,
+        max_keepalive_connections=SERPAPI_MAX_CONNECTIONS,
+        keepalive_expiry=30.0
+    )
+
+
+def get_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(base_url=SERPAPI_BASE_URL, timeout=SERPAPI_TIMEOUT, limits=_limits())
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(base_url=SERPAPI_BASE_URL, timeout=SERPAPI_TIMEOUT, limits=_limits())
+        _async_clients[loop] = client
+    return client
+
+
+async def aclose():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _request_params(params: dict) -> dict:
+    request_params = {k: v for k, v in params.items() if v is not None}
+    request_params.setdefault('api_key', os.environ.get('SERPAPI_API_KEY'))
+    request_params['output'] = 'json'
+    return request_params
+
+
+def _parse(response: httpx.Response) -> dict:
+    try:
+        data = response.json()
+    except ValueError:
+        raise SerpApiError(f'HTTP {response.status_code}: invalid JSON response',
+                           status_code=response.status_code, response=response)
+    if response.status_code >= 400 or 'error' in data:
+        raise SerpApiError(data.get('error', f'HTTP {response.status_code}'),
+                           status_code=response.status_code, response=response)
+    return data
+
+
+def begin_run(thread_id: str, resume: bool = False):
+    '''Start counting requests for a run of `thread_id`, dropping whatever an earlier run left.
+
+    With `resume`, a run this process is already counting keeps its count, e.g. a run
+    continued on another worker after a restart.
+    '''
+    if thread_id is None:
+        return
+    with _run_calls_lock:
+        _run_calls[thread_id] = _run_calls.get(thread_id, 0) if resume else 0
+        _run_calls.move_to_end(thread_id)
+        while len(_run_calls) > _MAX_RUNS:
+            _run_calls.popitem(last=False)
+
+
+def take_calls(thread_id: str) -> int:
+    '''Upstream requests made for `thread_id` since the last call, which resets the count.'''
+    with _run_calls_lock:
+        calls = _run_calls.get(thread_id, 0)
+        if thread_id in _run_calls:
+            _run_calls[thread_id] = 0
+        return calls
+
+
+def end_run(thread_id: str) -> int:
+    '''Like take_calls(), and stop counting: requests finishing later belong to no run.'''
+    with _run_calls_lock:
+        return _run_calls.pop(thread_id, 0)
+
+
+def remaining_calls():
+    '''Requests the current tool call may still make within the run's budget, or None.'''
+    allowance = _allowance.get()
+    if allowance is None:
+        return None
+    with _run_calls_lock:
+        return max(allowance - _run_calls.get(current_thread_id.get(), 0), 0)
+
+
+@contextlib.contextmanager
+def allowance(calls: int = None):
+    '''Let the tool calls run inside the block know how many requests the run has left.'''
+    token = _allowance.set(calls)
+    try:
+        yield
+    finally:
+        _allowance.reset(token)
+
+
+def _count_call():
+    thread_id = current_thread_id.get()
+    with _run_calls_lock:
+        if thread_id in _run_calls:
+            _run_calls[thread_id] += 1
+
+
+def _cached(cache: TTLCache, key: str):
+    '''The cached response or None, recording the lookup as a 'cache' metrics event.'''
+    if cache is None or cache.maxsize <= 0:
+        return None
+    data = cache.get(key)
+    METRICS.emit('cache', cache.name, hit=data is not None)
+    return data
+
+
+def search(params: dict, cache: TTLCache = None) -> dict:
+    '''Run a SerpAPI search over the shared keep-alive client and return the decoded JSON.
+
+    When a cache is given, identical searches (ignoring the API key) are answered from it;
+    only successful responses are stored. Identical searches running concurrently are
+    coalesced into a single upstream request.
+    '''
+    key = make_key(params)
+    data = _cached(cache, key)
+    if data is not None:
+        return data
+    try:
+        return IN_FLIGHT.do(key, lambda: _fetch(params, key, cache))
+    except QuotaExceeded as e:
+        # A coalesced search shares the leader's refusal; count it for this run too.
+        QUOTA.note_refusal(e.upstream)
+        raise
+
+
+async def asearch(params: dict, cache: TTLCache = None) -> dict:
+    '''Async counterpart of search() using the event loop's shared client.'''
+    key = make_key(params)
+    data = _cached(cache, key)
+    if data is not None:
+        return data
+    try:
+        return await IN_FLIGHT.ado(key, lambda: _afetch(params, key, cache))
+    except QuotaExceeded as e:
+        QUOTA.note_refusal(e.upstream)
+        raise
+
+
+def _fetch(params: dict, key: str, cache: TTLCache) -> dict:
+    data = SERPAPI_LIMITER.call(lambda: _get(params))
+    if cache is not None:
+        cache.set(key, data)
+    return data
+
+
+async def _afetch(params: dict, key: str, cache: TTLCache) -> dict:
+    data = await SERPAPI_LIMITER.acall(lambda: _aget(params))
+    if cache is not None:
+        cache.set(key, data)
+    return data
+
+
+def _get(params: dict) -> dict:
+    QUOTA.consume('serpapi')
+    _count_call()
+    with METRICS.timed('http', params.get('engine', 'serpapi')) as fields:
+        response = get_client().get('/search.json', params=_request_params(params))
+        fields['bytes'] = len(response.content)
+        return _parse(response)
+
+
+async def _aget(params: dict) -> dict:
+    QUOTA.consume('serpapi')
+    _count_call()
+    with METRICS.timed('http', params.get('engine', 'serpapi')) as fields:
+        response = await get_async_client().get('/search.json', params=_request_params(params))
+        fields['bytes'] = len(response.content)
+        return _parse(response)
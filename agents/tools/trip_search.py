@@ -0,0 +1,249 @@
+import asyncio
+import contextvars
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+
+from langchain.pydantic_v1 import BaseModel, Field
+from langchain_core.tools import StructuredTool
+
+from agents.config import env_float, env_int
+from agents.tools import serpapi_client
+from agents.tools.flights_finder import FlightsInput, compact_flights, flights_params
+from agents.tools.hotels_finder import HotelsInput, hotels_params
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# SerpAPI requests one trip_search call may make; larger date windows are sampled evenly.
+TRIP_SEARCH_MAX_SEARCHES = env_int('TRIP_SEARCH_MAX_SEARCHES', 24)
+# SerpAPI requests of one trip_search call running at the same time.
+TRIP_SEARCH_CONCURRENCY = env_int('TRIP_SEARCH_CONCURRENCY', 6)
+# Ranking weights, in USD: value of an hour of travel, cost of a stop, value of a rating point per night.
+TRIP_SEARCH_HOUR_COST = env_float('TRIP_SEARCH_HOUR_COST', 20.0)
+TRIP_SEARCH_STOP_COST = env_float('TRIP_SEARCH_STOP_COST', 50.0)
+TRIP_SEARCH_RATING_VALUE = env_float('TRIP_SEARCH_RATING_VALUE', 25.0)
+
+
+class TripSearchInput(BaseModel):
+    departure_airports: list[str] = Field(description='Departure airport codes (IATA), e.g. ["LHR", "LGW", "STN"] for any London airport')
+    arrival_airports: list[str] = Field(description='Arrival airport codes (IATA)')
+    earliest_outbound_date: str = Field(description='First possible outbound date. The format is YYYY-MM-DD')
+    latest_outbound_date: Optional[str] = Field(None, description='Last possible outbound date. The format is YYYY-MM-DD. Defaults to earliest_outbound_date')
+    min_nights: int = Field(description='Shortest stay, in nights')
+    max_nights: Optional[int] = Field(None, description='Longest stay, in nights. Defaults to min_nights')
+    hotel_location: Optional[str] = Field(None, description='Location of the hotel, e.g. the destination city. Leave empty to search flights only')
+    hotel_class: Optional[str] = Field(None, description='Only include these hotel classes, for example- 3,4')
+    adults: Optional[int] = Field(1, description='Number of adults. Default to 1.')
+    top_k: Optional[int] = Field(5, description='Number of trips to return. Default to 5.')
+
+
+class TripSearchInputSchema(BaseModel):
+    params: TripSearchInput
+
+
+def date_pairs(params: TripSearchInput, limit: int) -> list[tuple[str, str]]:
+    '''(outbound, return) dates of the search window, thinned evenly to at most `limit` pairs.'''
+    first = datetime.date.fromisoformat(params.earliest_outbound_date)
+    last = datetime.date.fromisoformat(params.latest_outbound_date or params.earliest_outbound_date)
+    max_nights = max(params.min_nights, params.max_nights or params.min_nights)
+    pairs = [
+        ((first + datetime.timedelta(days=d)).isoformat(), (first + datetime.timedelta(days=d + n)).isoformat())
+        for d in range(max((last - first).days, 0) + 1)
+        for n in range(params.min_nights, max_nights + 1)
+    ]
+    if len(pairs) <= limit:
+        return pairs
+    if limit <= 1:
+        return pairs[:1]
+    return [pairs[i] for i in sorted({round(k * (len(pairs) - 1) / (limit - 1)) for k in range(limit)})]
+
+
+def plan_searches(params: TripSearchInput, limit: int = None) -> list[dict]:
+    '''The grid of SerpAPI searches for a request, capped at TRIP_SEARCH_MAX_SEARCHES (or `limit`).'''
+    limit = max(TRIP_SEARCH_MAX_SEARCHES if limit is None else min(limit, TRIP_SEARCH_MAX_SEARCHES), 1)
+    routes = [(d.upper(), a.upper()) for d in params.departure_airports for a in params.arrival_airports if d.upper() != a.upper()]
+    hotel_searches = 1 if params.hotel_location else 0
+    if len(routes) + hotel_searches > limit:
+        # Too many routes for even one date pair: search the first ones (and the hotel).
+        routes = routes[:max(limit - hotel_searches, 1)]
+    per_pair = len(routes) + hotel_searches
+    if not per_pair:
+        return []
+    searches = []
+    for outbound, inbound in date_pairs(params, max(limit // per_pair, 1)):
+        for departure, arrival in routes:
+            flight = FlightsInput(departure_airport=departure, arrival_airport=arrival, outbound_date=outbound,
+                                  return_date=inbound, adults=params.adults)
+            searches.append({'kind': 'flights', 'dates': (outbound, inbound), 'params': flights_params(flight),
+                             'cache': serpapi_client.FLIGHTS_CACHE})
+        if params.hotel_location:
+            hotel = HotelsInput(q=params.hotel_location, check_in_date=outbound, check_out_date=inbound,
+                                adults=params.adults, hotel_class=params.hotel_class)
+            searches.append({'kind': 'hotels', 'dates': (outbound, inbound), 'params': hotels_params(hotel),
+                             'cache': serpapi_client.HOTELS_CACHE})
+    return searches[:limit]
+
+
+def _hotel(hotel: dict) -> dict:
+    images = hotel.get('images') or [{}]
+    compacted = {
+        'name': hotel.get('name'),
+        'price_per_night': (hotel.get('rate_per_night') or {}).get('extracted_lowest'),
+        'total_price': (hotel.get('total_rate') or {}).get('extracted_lowest'),
+        'rating': hotel.get('overall_rating'),
+        'reviews': hotel.get('reviews'),
+        'hotel_class': hotel.get('extracted_hotel_class'),
+        'link': hotel.get('link'),
+        'image': images[0].get('thumbnail')
+    }
+    return {k: v for k, v in compacted.items() if v is not None}
+
+
+def _column(items: list[dict], field: str) -> 'np.ndarray':
+    import numpy as np
+
+    return np.array([item.get(field) if isinstance(item.get(field), (int, float)) else np.nan for item in items], dtype=float)
+
+
+def rank_trips(flights: list, hotels: list, top_k: int) -> list[dict]:
+    '''Rank flight options, each paired with the best hotel for the same dates.
+
+    `flights` and `hotels` are lists of ((outbound, return), option) pairs. Every option
+    gets a cost in USD: the price plus TRIP_SEARCH_HOUR_COST per hour of travel and
+    TRIP_SEARCH_STOP_COST per stop for flights, the stay's price minus
+    TRIP_SEARCH_RATING_VALUE per rating point and night for hotels. Options without a
+    price are never picked.
+    '''
+    # NumPy is only needed once the model actually uses trip_search.
+    import numpy as np
+
+    if not flights:
+        return []
+    options = [option for _, option in flights]
+    price = _column(options, 'price')
+    cost = price + TRIP_SEARCH_HOUR_COST * np.nan_to_num(_column(options, 'total_duration')) / 60 \
+        + TRIP_SEARCH_STOP_COST * np.nan_to_num(_column(options, 'stops'))
+    cost = np.where(np.isnan(price), np.inf, cost)
+    nights = np.array([(datetime.date.fromisoformat(r) - datetime.date.fromisoformat(o)).days for (o, r), _ in flights])
+
+    best_hotel = np.full(len(flights), -1)
+    if hotels:
+        stays = [hotel for _, hotel in hotels]
+        hotel_nights = np.array([(datetime.date.fromisoformat(r) - datetime.date.fromisoformat(o)).days for (o, r), _ in hotels])
+        total = np.where(np.isnan(_column(stays, 'total_price')), _column(stays, 'price_per_night') * hotel_nights,
+                         _column(stays, 'total_price'))
+        hotel_cost = total - TRIP_SEARCH_RATING_VALUE * hotel_nights * np.nan_to_num(_column(stays, 'rating'))
+        hotel_cost = np.where(np.isnan(total), np.inf, hotel_cost)
+        # flights x hotels matrix; pairs with different dates can't be combined.
+        date_ids = {}
+        flight_dates = np.array([date_ids.setdefault(d, len(date_ids)) for d, _ in flights])
+        hotel_dates = np.array([date_ids.setdefault(d, len(date_ids)) for d, _ in hotels])
+        same_dates = flight_dates[:, None] == hotel_dates[None, :]
+        combined = np.where(same_dates, hotel_cost[None, :], np.inf)
+        best_hotel = np.where(np.isinf(combined.min(axis=1)), -1, combined.argmin(axis=1))
+        cost = cost + np.where(best_hotel >= 0, combined.min(axis=1), 0)
+        totals = price + np.where(best_hotel >= 0, total[np.maximum(best_hotel, 0)], 0)
+    else:
+        totals = price
+
+    order = np.argsort(cost, kind='stable')[:max(top_k, 1)]
+    trips = []
+    for i in order:
+        if np.isinf(cost[i]):
+            break
+        (outbound, inbound), option = flights[i]
+        trip = {'outbound_date': outbound, 'return_date': inbound, 'nights': int(nights[i]), 'flight': option}
+        if best_hotel[i] >= 0:
+            trip['hotel'] = hotels[best_hotel[i]][1]
+        trip['estimated_total'] = None if np.isnan(totals[i]) else round(float(totals[i]), 2)
+        trips.append(trip)
+    return trips
+
+
+def _collect(searches: list[dict], responses: list, top_k: int) -> dict:
+    flights, hotels, errors = [], [], []
+    for search, response in zip(searches, responses):
+        if isinstance(response, Exception):
+            errors.append(f"{search['kind']} {' to '.join(search['dates'])}: {response}")
+        elif search['kind'] == 'flights':
+            route = {'from_airport': search['params']['departure_id'], 'to_airport': search['params']['arrival_id']}
+            count = len(response.get('best_flights', [])) + len(response.get('other_flights', []))
+            flights += [(search['dates'], {**route, **option}) for option in compact_flights(response, limit=count)]
+        else:
+            hotels += [(search['dates'], _hotel(hotel)) for hotel in response.get('properties', [])]
+    result = {
+        'searches': len(searches),
+        'date_pairs': sorted({search['dates'] for search in searches}),
+        'trips': rank_trips(flights, hotels, top_k)
+    }
+    if errors:
+        result['errors'] = errors
+    return result
+
+
+def _plan(params: TripSearchInput):
+    # Cache hits are free, so this is conservative: the run may have budget left afterwards.
+    remaining = serpapi_client.remaining_calls()
+    if remaining == 0:
+        return "Not searched: the run's serpapi_calls budget is used up."
+    try:
+        searches = plan_searches(params, remaining)
+    except Exception as e:
+        return str(e)
+    if not searches:
+        return 'No route to search: departure and arrival airports are the same.'
+    return searches
+
+
+def _search(search: dict):
+    try:
+        return serpapi_client.search(search['params'], cache=search['cache'])
+    except Exception as e:
+        return e
+
+
+async def _asearch(search: dict, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            return await serpapi_client.asearch(search['params'], cache=search['cache'])
+        except Exception as e:
+            return e
+
+
+def _trip_search(params: TripSearchInput):
+    '''
+    Search flights (and optionally hotels) for every combination of several departure
+    airports, arrival airports, outbound dates and trip lengths in one call, and return
+    the cheapest trips ranked by price, travel time, stops and hotel rating. Use this
+    instead of many flights_finder calls when the dates or airports are flexible.
+
+    Returns:
+        dict: The number of searches made, the dates searched and the top trips.
+    '''
+    searches = _plan(params)
+    if isinstance(searches, str):
+        return searches
+    with ThreadPoolExecutor(max_workers=max(1, min(len(searches), TRIP_SEARCH_CONCURRENCY)),
+                            thread_name_prefix='trip_search') as pool:
+        # Each search gets its own copy of the context so metrics keep the run's thread_id.
+        futures = [pool.submit(contextvars.copy_context().run, _search, search) for search in searches]
+        responses = [future.result() for future in futures]
+    return _collect(searches, responses, params.top_k or 5)
+
+
+async def _atrip_search(params: TripSearchInput):
+    searches = _plan(params)
+    if isinstance(searches, str):
+        return searches
+    semaphore = asyncio.Semaphore(max(1, TRIP_SEARCH_CONCURRENCY))
+    responses = await asyncio.gather(*(_asearch(search, semaphore) for search in searches))
+    return _collect(searches, responses, params.top_k or 5)
+
+
+trip_search = StructuredTool.from_function(
+    func=_trip_search,
+    coroutine=_atrip_search,
+    name='trip_search',
+    args_schema=TripSearchInputSchema
+)
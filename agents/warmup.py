@@ -0,0 +1,76 @@
+'''Warm-up of the shared agent before a server takes traffic.
+
+    python -m agents.warmup                  # warm up once and print the timings
+    python -m agents.warmup --serve app.py   # warm up, then run the Streamlit app in this process
+
+With --serve the Streamlit server only starts listening (and its health endpoint only
+answers) once the graph is compiled and the upstream connections are open, and the app's
+sessions reuse the agent built here because they run in the same process.
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+import httpx
+
+from agents.config import env_float
+
+# Seconds each upstream connection attempt of the warm-up may take.
+WARMUP_TIMEOUT = env_float('WARMUP_TIMEOUT', 5.0)
+
+
+def _timed(timings: dict, name: str, fn):
+    started = time.perf_counter()
+    try:
+        fn()
+    except httpx.HTTPError as e:
+        # An unreachable upstream must not keep the server from starting.
+        print(f'Warm-up: {name} not reachable: {e}')
+    timings[name] = round(time.perf_counter() - started, 3)
+
+
+def warm_up() -> dict:
+    '''Import the heavy dependencies, build the shared agent and open upstream connections.
+
+    Returns the seconds spent on each step.
+    '''
+    from agents.agent import get_agent
+    from agents.llm import _get_http_client
+    from agents.tools import serpapi_client
+
+    timings = {}
+    holder = {}
+    _timed(timings, 'agent', lambda: holder.setdefault('agent', get_agent()))
+    # One read through the checkpointer creates its tables and loads the query path.
+    _timed(timings, 'checkpointer', lambda: holder['agent'].graph.get_state({'configurable': {'thread_id': '__warmup__'}}))
+    # Any response will do: the point is the TLS handshake kept alive in the shared pools.
+    _timed(timings, 'serpapi', lambda: serpapi_client.get_client().head('/', timeout=WARMUP_TIMEOUT))
+    openai_url = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+    _timed(timings, 'openai', lambda: _get_http_client().head(openai_url, timeout=WARMUP_TIMEOUT))
+    return timings
+
+
+def serve(script: str, args: list):
+    from streamlit.web import bootstrap
+
+    bootstrap.run(script, False, args, {})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--serve', metavar='SCRIPT', help='Streamlit script to run once warmed up')
+    parser.add_argument('args', nargs='*', help='arguments passed on to the script')
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    timings = warm_up()
+    timings['total'] = round(time.perf_counter() - started, 3)
+    print(f'Warm-up finished: {json.dumps(timings)}')
+    if args.serve:
+        serve(args.serve, args.args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
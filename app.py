@@ -7,7 +7,7 @@ from langchain_core.messages import HumanMessage
 # Add this BEFORE the import
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from agents.agent import Agent
+from agents.service import AGENT_SERVICE, AgentService
 
 # Rest of the code remains the same
 
@@ -29,9 +29,14 @@ def populate_envs(receiver_email, subject):
 def send_email(receiver_email, subject, thread_id):
     try:
         populate_envs(receiver_email, subject)
-        config = {'configurable': {'thread_id': thread_id}}
-        st.session_state.agent.graph.invoke(None, config=config)
-        st.success('Email sent successfully!')
+        if AGENT_SERVICE:
+            # The worker resumes the thread's interrupted run, like graph.invoke(None) below.
+            service = st.session_state.service
+            service.wait(service.send_email(thread_id, receiver_email, subject, os.environ['FROM_EMAIL']))
+        else:
+            config = {'configurable': {'thread_id': thread_id, 'to_email': receiver_email, 'email_subject': subject}}
+            st.session_state.agent.graph.invoke(None, config=config)
+        st.success('Your travel plan is on its way! The email is being delivered in the background.')
         for key in ['travel_info', 'thread_id']:
             st.session_state.pop(key, None)
     except Exception as e:
@@ -57,9 +62,17 @@ def render_email_form():
 
 
 def initialize_agent():
+    if AGENT_SERVICE:
+        # Planning runs in the worker processes of agents.service; this process only queues jobs.
+        if 'service' not in st.session_state:
+            st.session_state.service = AgentService()
+        return
     if 'agent' not in st.session_state:
+        from agents.agent import get_agent
+
+        # One Agent per process; sessions only differ by their thread_id
         with st.spinner('Initializing AI Travel Assistant...'):
-            st.session_state.agent = Agent()
+            st.session_state.agent = get_agent()
 
 def render_custom_css():
     st.markdown('''
@@ -271,25 +284,65 @@ def process_query(user_input):
             thread_id = str(uuid.uuid4())
             st.session_state.thread_id = thread_id
 
+            if AGENT_SERVICE:
+                # Kept in the session so a rerun while the job runs can pick up its events again.
+                st.session_state.job_id = st.session_state.service.plan(thread_id, user_input)
+                show_job(st.session_state.job_id)
+                return
+
             # Prepare and process query
             messages = [HumanMessage(content=user_input)]
             config = {'configurable': {'thread_id': thread_id}}
-
-            with st.spinner('Analyzing your travel request...'):
-                result = st.session_state.agent.graph.invoke({'messages': messages}, config=config)
+            placeholder = render_plan(st.session_state.agent.stream_plan({'messages': messages}, config))
 
             # Display results
-            st.subheader('Your Personalized Travel Plan')
-            st.write(result['messages'][-1].content)
-
-            # Store result in session state
-            st.session_state.travel_info = result['messages'][-1].content
+            state = st.session_state.agent.graph.get_state(config)
+            show_result(placeholder, state.values['messages'][-1].content, state.values.get('budget'))
 
         except Exception as e:
             st.error(f'Error processing your request: {e}')
     else:
         st.error('Please enter a detailed travel query.')
 
+def show_job(job_id):
+    service = st.session_state.service
+    try:
+        placeholder = render_plan(service.stream(job_id))
+        result = service.queue.job(job_id)['result']
+        show_result(placeholder, result['plan'], result.get('budget'))
+    except Exception as e:
+        st.error(f'Error processing your request: {e}')
+    # Not in a finally: Streamlit stops a script for a rerun by raising through here.
+    st.session_state.pop('job_id', None)
+
+def render_plan(events):
+    # Stream progress and the plan itself instead of waiting for the whole run
+    st.subheader('Your Personalized Travel Plan')
+    status = st.status('Analyzing your travel request...')
+    placeholder = st.empty()
+    text = ''
+    for kind, value in events:
+        if kind == 'progress':
+            status.update(label=value)
+            status.write(value)
+        elif kind == 'reset':
+            text = ''
+            placeholder.empty()
+        else:
+            text += value
+            placeholder.markdown(text + '▌')
+    status.update(label='Your travel plan is ready', state='complete')
+    return placeholder
+
+def show_result(placeholder, content, budget):
+    placeholder.write(content)
+    exhausted = (budget or {}).get('exhausted')
+    if exhausted:
+        st.caption(f'The search stopped early because its {exhausted.replace("_", " ")} budget ran out.')
+
+    # Store result in session state
+    st.session_state.travel_info = content
+
 def render_email_form():
     send_email_option = st.radio('Share Your Travel Plan', ('Keep to Myself', 'Send via Email'))
     if send_email_option == 'Send via Email':
@@ -311,6 +364,9 @@ def main():
 
     if st.button('Generate My Travel Plan'):
         process_query(user_input)
+    elif 'job_id' in st.session_state:
+        # The page was rerun while the service was planning: keep showing that job.
+        show_job(st.session_state.job_id)
 
     if 'travel_info' in st.session_state:
         render_email_form()
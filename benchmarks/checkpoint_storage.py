@@ -0,0 +1,165 @@
+'''Compare full-state and delta checkpoint storage on long tool loops.
+
+Runs the real Agent graph (ScriptedChatModel, StubSerpApiServer) once with the plain
+PrunedSqliteSaver, which stores the whole message history in every checkpoint, and
+once with DeltaSqliteSaver, which stores every message once and refers to it. Context
+compaction is switched off so the history grows with every tool round, like it would
+in a long loop. Reports the time spent in the checkpointer, the bytes it stored, the
+database size and the median peak Python heap of a session:
+
+    python -m benchmarks.checkpoint_storage --sessions 20 --tool-rounds 10
+'''
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from benchmarks.stubs import ScriptedChatModel, StubSerpApiServer
+
+SAVERS = ('full', 'delta')
+TABLES = ('checkpoints', 'writes', 'checkpoint_blobs', 'checkpoint_payloads')
+
+
+def _timed(saver, timings: dict, name: str):
+    method = getattr(saver, name)
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+    setattr(saver, name, timed)
+
+
+def _session(agent, query: str, tool_rounds: int):
+    from langchain_core.messages import HumanMessage
+
+    # Budgets off: every session runs all its tool rounds, three graph steps each.
+    config = {
+        'configurable': {
+            'thread_id': f'bench-{uuid.uuid4()}',
+            'max_iterations': 0, 'deadline': 0, 'max_tokens': 0, 'max_serpapi_calls': 0
+        },
+        'recursion_limit': 3 * tool_rounds + 10
+    }
+    agent.graph.invoke({'messages': [HumanMessage(content=query)]}, config)
+    # Resume the interrupted run, like the email step does.
+    agent.graph.invoke(None, {**config, 'configurable': {**config['configurable'], 'to_email': 'bench@example.com'}})
+
+
+def _stored_bytes(conn) -> dict:
+    stored = {}
+    for table, column in zip(TABLES, ('checkpoint', 'value', 'value', 'content')):
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if exists:
+            stored[table] = conn.execute(f'SELECT COALESCE(SUM(LENGTH({column})), 0) FROM {table}').fetchone()[0]
+    return stored
+
+
+def measure(kind: str, args, workdir: str) -> dict:
+    from agents import db
+    from agents.agent import Agent
+    from agents.checkpointer import DeltaSqliteSaver, PrunedSqliteSaver
+
+    path = os.path.join(workdir, f'{kind}.sqlite')
+    saver = (DeltaSqliteSaver if kind == 'delta' else PrunedSqliteSaver)(db.connect(path))
+    timings = {}
+    for name in ('put', 'put_writes', 'get_tuple'):
+        _timed(saver, timings, name)
+
+    class Outbox:
+        def submit(self, mail_body):
+            pass
+
+    agent = Agent(
+        checkpointer=saver,
+        tools_llm=ScriptedChatModel(tool_rounds=args.tool_rounds),
+        email_llm=ScriptedChatModel(tool_rounds=0),
+        email_queue=Outbox(),
+        prefetcher=None
+    )
+    _session(agent, args.query, args.tool_rounds)  # warm imports and connections
+    timings.clear()
+
+    started = time.perf_counter()
+    for _ in range(args.sessions):
+        _session(agent, args.query, args.tool_rounds)
+    elapsed = time.perf_counter() - started
+
+    # The peak of a single session moves with garbage collection timing; take the median.
+    peaks = []
+    for _ in range(max(1, args.heap_runs)):
+        gc.collect()
+        tracemalloc.start()
+        _session(agent, args.query, args.tool_rounds)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    saver.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    stored = _stored_bytes(saver.conn)
+    return {
+        'elapsed_s': elapsed,
+        'checkpointer_s': sum(timings.values()),
+        'checkpointer_s_per_session': sum(timings.values()) / args.sessions,
+        'timings_s': timings,
+        'stored_bytes': sum(stored.values()),
+        'stored_bytes_by_table': stored,
+        'db_bytes': os.path.getsize(path),
+        'session_peak_heap_bytes': statistics.median(peaks)
+    }
+
+
+def run(args) -> dict:
+    server = StubSerpApiServer().start()
+    # Settings are read at import time, so the environment must be ready before agents is imported.
+    os.environ['SERPAPI_BASE_URL'] = server.url
+    os.environ.setdefault('SERPAPI_API_KEY', 'bench')
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ.setdefault('FROM_EMAIL', 'bench@example.com')
+    os.environ.setdefault('EMAIL_SUBJECT', 'Benchmark')
+    os.environ['SEARCH_CACHE_SIZE'] = '0'
+    os.environ['PREFETCH_ENABLED'] = '0'
+    os.environ['CONTEXT_MAX_TOKENS'] = '0'
+    workdir = tempfile.mkdtemp(prefix='checkpoint-bench-')
+    try:
+        results = {kind: measure(kind, args, workdir) for kind in SAVERS}
+    finally:
+        server.stop()
+    full, delta = results['full'], results['delta']
+    results['savings'] = {
+        metric: 1 - delta[metric] / full[metric] if full[metric] else 0.0
+        for metric in ('checkpointer_s', 'stored_bytes', 'db_bytes', 'session_peak_heap_bytes')
+    }
+    results['params'] = {'sessions': args.sessions, 'tool_rounds': args.tool_rounds, 'heap_runs': args.heap_runs}
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20, help='planning sessions per checkpointer')
+    parser.add_argument('--tool-rounds', type=int, default=10, help='tool-calling turns per session')
+    parser.add_argument('--heap-runs', type=int, default=5, help='sessions whose peak heap is measured')
+    parser.add_argument('--query', default='I want to travel to Amsterdam from Madrid from October 1st to 7th.')
+    parser.add_argument('--verbose', action='store_true', help="show the agent's own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+        results = run(args)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+'''Import budget check for cold starts.
+
+Imports a module in a fresh interpreter with `-X importtime` and exits with status 1
+when it loads any of the dependencies the app only loads on first use (the OpenAI
+client, MailerSend, NumPy, tiktoken), printing the chain of imports that pulled each
+one in. With --max-seconds it also fails when the module's cumulative import time,
+the median of --runs fresh interpreters, is over the budget, which catches slow new
+eager imports that are not listed:
+
+    python -m benchmarks.import_budget --max-seconds 3.0
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages that must not be imported by `import agents.agent`.
+DEFERRED = ('langchain_openai', 'openai', 'mailersend', 'numpy', 'tiktoken')
+
+
+def import_tree(module: str) -> list:
+    '''(depth, name, cumulative seconds) of every module imported by `import module`.
+
+    Entries are in the order -X importtime prints them: a module comes after everything
+    it imported, at a smaller depth.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    tree = []
+    for line in result.stderr.splitlines():
+        fields = line[len('import time:'):].split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()[1:]
+        tree.append(((len(name) - len(name.lstrip())) // 2, name.strip(), int(fields[1]) / 1e6))
+    return tree
+
+
+def import_chain(tree: list, index: int) -> list:
+    '''Names of the modules that led to the import of tree[index], outermost first.'''
+    chain = [tree[index][1]]
+    depth = tree[index][0]
+    for entry_depth, name, _ in tree[index + 1:]:
+        if entry_depth < depth:
+            chain.append(name)
+            depth = entry_depth
+    return chain[::-1]
+
+
+def deferred_imports(tree: list, deferred=DEFERRED) -> dict:
+    '''Deferred packages that were imported, each with the chain of its first import.'''
+    found = {}
+    for i, (_, name, _) in enumerate(tree):
+        package = name.split('.')[0]
+        if package in deferred and package not in found:
+            found[package] = import_chain(tree, i)
+    return found
+
+
+def module_seconds(tree: list, module: str) -> float:
+    '''Cumulative import time of `module` itself, including everything it imported.'''
+    return next((seconds for depth, name, seconds in tree if depth == 0 and name == module), 0.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='agents.agent', help='module whose imports are checked')
+    parser.add_argument('--deferred', nargs='*', default=list(DEFERRED),
+                        help='top-level packages the module must not import')
+    parser.add_argument('--max-seconds', type=float, help='fail when the median import time is over this budget')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters timed for the median')
+    parser.add_argument('--top', type=int, default=10, help='heaviest imports to list')
+    args = parser.parse_args(argv)
+
+    trees = [import_tree(args.module) for _ in range(max(args.runs, 1))]
+    tree = trees[0]
+    total = statistics.median(module_seconds(t, args.module) for t in trees)
+    print(f'import {args.module}: {total:.3f}s (median of {len(trees)}), {len(tree)} modules')
+    # Direct imports of the module, i.e. the entries nested one level below it.
+    direct = {name: seconds for depth, name, seconds in tree if depth == 1}
+    for name, seconds in sorted(direct.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'  {seconds:8.3f}s  {name}')
+    failed = False
+    for package, chain in deferred_imports(tree, tuple(args.deferred)).items():
+        print(f'FAIL: {package} is imported at startup: {" -> ".join(chain)}')
+        failed = True
+    if args.max_seconds is not None and total > args.max_seconds:
+        print(f'FAIL: import {args.module} took {total:.3f}s, over the budget of {args.max_seconds:g}s')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
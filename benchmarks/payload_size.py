@@ -0,0 +1,55 @@
+'''Measure how much the compact flight projection shrinks the tool output sent to the model.
+
+Usage: python -m benchmarks.payload_size [path/to/google_flights.json]
+'''
+import json
+import os
+import sys
+
+from agents.tools.flights_finder import FLIGHTS_RESULT_LIMIT, compact_flights
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'google_flights.json')
+
+
+def count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+        return len(tiktoken.encoding_for_model('gpt-3.5-turbo').encode(text))
+    except Exception:
+        # Rough estimate for English/JSON text when tiktoken is not installed or can't
+        # download its encoding (it fetches it on first use).
+        return len(text) // 4
+
+
+def measure(data: dict) -> dict:
+    compacted = compact_flights(data)
+    # Before: str() of the raw options, as invoke_tools used to send them, for the same
+    # options the projection keeps.
+    raw = (data.get('best_flights', []) + data.get('other_flights', []))[:len(compacted)]
+    before = str(raw)
+    after = json.dumps(compacted, separators=(',', ':'), ensure_ascii=False)
+    report = {
+        'result_limit': FLIGHTS_RESULT_LIMIT,
+        'before_options': len(raw),
+        'after_options': len(compacted),
+        'before_bytes': len(before.encode()),
+        'after_bytes': len(after.encode()),
+        'before_tokens': count_tokens(before),
+        'after_tokens': count_tokens(after)
+    }
+    report['bytes_reduction'] = 1 - report['after_bytes'] / report['before_bytes']
+    report['tokens_reduction'] = 1 - report['after_tokens'] / report['before_tokens']
+    report['tokens_per_option_before'] = report['before_tokens'] / max(len(raw), 1)
+    report['tokens_per_option_after'] = report['after_tokens'] / max(len(compacted), 1)
+    return report
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE
+    with open(path) as f:
+        data = json.load(f)
+    print(json.dumps(measure(data), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+'''Offline benchmark of the compiled travel-agent graph.
+
+Runs the real Agent graph against ScriptedChatModel and StubSerpApiServer (see
+benchmarks/stubs.py), so no OpenAI, SerpAPI or MailerSend traffic is generated, and
+reports per-node latency, end-to-end percentiles, throughput under concurrent sessions
+and memory growth per thread. Results are written as JSON and can be compared with a
+previous run:
+
+    python -m benchmarks.run --sessions 200 --concurrency 16 --output before.json
+    python -m benchmarks.run --sessions 200 --concurrency 16 --compare before.json
+'''
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stubs import ScriptedChatModel, StubEmailSender, StubSerpApiServer
+
+NODES = ('call_tools_llm', 'invoke_tools', 'email_sender')
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(values) -> dict:
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99)
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.nodes = {name: [] for name in NODES}
+        self.plan = []
+        self.email = []
+
+    def add_nodes(self, timings):
+        for node, seconds in timings:
+            if node in self.nodes:
+                self.nodes[node].append(seconds)
+
+
+def _timed_updates(events, started):
+    # Nodes run one after another, so each update closes the interval opened by the previous one.
+    timings = []
+    previous = started
+    for chunk in events:
+        now = time.perf_counter()
+        for node in chunk:
+            timings.append((node, now - previous))
+        previous = now
+    return timings
+
+
+def run_session(agent, recorder, query):
+    from langchain_core.messages import HumanMessage
+
+    config = {'configurable': {'thread_id': f'bench-{uuid.uuid4()}'}}
+    started = time.perf_counter()
+    timings = _timed_updates(
+        agent.graph.stream({'messages': [HumanMessage(content=query)]}, config, stream_mode='updates'), started
+    )
+    recorder.plan.append(time.perf_counter() - started)
+    resume_config = {'configurable': {**config['configurable'], 'to_email': 'bench@example.com', 'email_subject': 'Benchmark'}}
+    started = time.perf_counter()
+    timings += _timed_updates(agent.graph.stream(None, resume_config, stream_mode='updates'), started)
+    recorder.email.append(time.perf_counter() - started)
+    recorder.add_nodes(timings)
+
+
+async def arun_session(agent, recorder, query):
+    from langchain_core.messages import HumanMessage
+
+    config = {'configurable': {'thread_id': f'bench-{uuid.uuid4()}'}}
+    for inputs, key in (({'messages': [HumanMessage(content=query)]}, 'plan'), (None, 'email')):
+        if inputs is None:
+            config = {'configurable': {**config['configurable'], 'to_email': 'bench@example.com', 'email_subject': 'Benchmark'}}
+        started = previous = time.perf_counter()
+        async for chunk in agent.graph.astream(inputs, config, stream_mode='updates'):
+            now = time.perf_counter()
+            recorder.add_nodes([(node, now - previous) for node in chunk])
+            previous = now
+        getattr(recorder, key).append(time.perf_counter() - started)
+
+
+def measure_memory(agent, sessions, query) -> dict:
+    '''Python heap growth per completed thread, measured with tracemalloc.'''
+    recorder = Recorder()
+    run_session(agent, recorder, query)  # warm imports and pools before the baseline
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    for _ in range(sessions):
+        run_session(agent, recorder, query)
+    current = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    growth = sum(stat.size_diff for stat in current.compare_to(baseline, 'filename'))
+    return {'sessions': sessions, 'heap_growth_bytes': growth, 'bytes_per_thread': growth / sessions}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    server = StubSerpApiServer(latency=args.serpapi_latency).start()
+    workdir = tempfile.mkdtemp(prefix='agent-bench-')
+    # Settings are read at import time, so the environment must be ready before agents is imported.
+    os.environ['SERPAPI_BASE_URL'] = server.url
+    os.environ.setdefault('SERPAPI_API_KEY', 'bench')
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ.setdefault('FROM_EMAIL', 'bench@example.com')
+    os.environ['CHECKPOINTER'] = args.checkpointer
+    os.environ['CHECKPOINT_DB'] = os.path.join(workdir, 'checkpoints.sqlite')
+    if not args.cache:
+        os.environ['SEARCH_CACHE_SIZE'] = '0'
+    os.environ['PREFETCH_ENABLED'] = '1' if args.prefetch else '0'
+
+    from agents.agent import Agent
+    from agents.email_queue import EmailQueue
+
+    sender = StubEmailSender()
+    email_queue = EmailQueue(send=sender)
+    agent = Agent(
+        tools_llm=ScriptedChatModel(latency=args.llm_latency, tool_rounds=args.tool_rounds),
+        email_llm=ScriptedChatModel(latency=args.llm_latency, tool_rounds=0),
+        email_queue=email_queue
+    )
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    if args.use_async:
+        async def main():
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one():
+                async with semaphore:
+                    await arun_session(agent, recorder, args.query)
+
+            await asyncio.gather(*(one() for _ in range(args.sessions)))
+        asyncio.run(main())
+    else:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for future in [pool.submit(run_session, agent, recorder, args.query) for _ in range(args.sessions)]:
+                future.result()
+    elapsed = time.perf_counter() - started
+    email_queue.join(timeout=30)
+
+    memory = measure_memory(agent, args.memory_sessions, args.query) if args.memory_sessions else None
+    server.stop()
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+        },
+        'metrics': {
+            'nodes': {name: summarize(values) for name, values in recorder.nodes.items()},
+            'plan_latency': summarize(recorder.plan),
+            'email_latency': summarize(recorder.email),
+            'throughput_sessions_per_s': args.sessions / elapsed,
+            'elapsed_s': elapsed,
+            'serpapi_requests': server.requests,
+            'prefetch': agent._prefetcher.stats() if agent._prefetcher else None,
+            'emails_sent': sender.sent,
+            'memory': memory,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+    }
+
+
+def _flatten(metrics, prefix=''):
+    for key, value in metrics.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{name}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(previous: dict, current: dict) -> str:
+    old = dict(_flatten(previous['metrics']))
+    lines = [f'{"metric":45} {"before":>14} {"after":>14} {"change":>9}']
+    for name, value in _flatten(current['metrics']):
+        if name not in old:
+            continue
+        change = (value - old[name]) / old[name] * 100 if old[name] else 0.0
+        lines.append(f'{name:45} {old[name]:14.4f} {value:14.4f} {change:+8.1f}%')
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=50, help='planning sessions to run')
+    parser.add_argument('--concurrency', type=int, default=8, help='sessions running at the same time')
+    parser.add_argument('--tool-rounds', type=int, default=1, help='tool-calling turns per session')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='seconds per scripted model call')
+    parser.add_argument('--serpapi-latency', type=float, default=0.3, help='seconds per stub SerpAPI request')
+    parser.add_argument('--checkpointer', choices=('memory', 'sqlite'), default='sqlite')
+    parser.add_argument('--cache', action='store_true', help='enable the SerpAPI search cache')
+    parser.add_argument('--no-prefetch', dest='prefetch', action='store_false',
+                        help='disable speculative searches started from the parsed query')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='drive the graph with astream')
+    parser.add_argument('--memory-sessions', type=int, default=20,
+                        help='sequential sessions used to measure memory growth per thread (0 to skip)')
+    parser.add_argument('--query', default='I want to travel to Amsterdam from Madrid from October 1st to 7th.')
+    parser.add_argument('--verbose', action='store_true', help="show the agent's own output")
+    parser.add_argument('--output', help='where to write the JSON results (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The agent prints every tool call; keep the report readable unless asked otherwise.
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+        results = run(args)
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results['metrics'], indent=2))
+    print(f'Results written to {output}')
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+'''Local stand-ins for OpenAI and SerpAPI used by the benchmark harness.'''
+import asyncio
+import datetime
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+FINAL_PLAN = '''# Your Trip to Amsterdam
+
+## Flights
+1. **KLM** ![KLM](https://www.gstatic.com/flights/airline_logos/70px/KL.png) - $229 round trip
+   Departs MAD 07:34, arrives AMS 10:09, nonstop
+
+## Hotels
+| Hotel | Price per night | Rating |
+|---|---|---|
+| [Pulitzer Amsterdam](https://www.example-hotel-1.com/) | $245 | 4.6 |
+| [Hotel Estherea](https://www.example-hotel-0.com/) | $198 | 4.7 |
+
+Prices are in USD and were correct at the time of the search.
+'''
+
+
+def load_fixture(engine: str) -> dict:
+    with open(os.path.join(FIXTURES, f'{engine}.json')) as f:
+        return json.load(f)
+
+
+class ScriptedChatModel(BaseChatModel):
+    '''Chat model that replays a fixed tool-calling script instead of calling OpenAI.
+
+    For every conversation it asks for a flight and a hotel search `tool_rounds` times
+    (shifting the dates each round so searches are distinct) and then writes FINAL_PLAN.
+    The round is derived from the tool results since the last human message, so one
+    instance can serve any number of concurrent threads. With tool_rounds=0 it always
+    answers with the plan, which makes it usable as the email model too. The first
+    round searches the dates named in the query, like a real model would, so the
+    speculative prefetch can match it.
+    '''
+
+    latency: float = 0.0
+    tool_rounds: int = 1
+    prompt_tokens_per_message: int = 40
+    completion_tokens: int = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return 'scripted'
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages) -> AIMessage:
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+        round_ = sum(isinstance(m, ToolMessage) for m in messages[last_human:]) // 2
+        usage = {
+            'input_tokens': self.prompt_tokens_per_message * len(messages),
+            'output_tokens': self.completion_tokens,
+            'total_tokens': self.prompt_tokens_per_message * len(messages) + self.completion_tokens
+        }
+        if round_ >= self.tool_rounds:
+            return AIMessage(content=FINAL_PLAN, usage_metadata=usage)
+        outbound, inbound = self._dates(messages[last_human].content, round_)
+        return AIMessage(content='', usage_metadata=usage, tool_calls=[
+            {
+                'name': 'flights_finder',
+                'id': f'call_flights_{round_}',
+                'args': {'params': {
+                    'departure_airport': 'MAD', 'arrival_airport': 'AMS',
+                    'outbound_date': outbound, 'return_date': inbound
+                }}
+            },
+            {
+                'name': 'hotels_finder',
+                'id': f'call_hotels_{round_}',
+                'args': {'params': {'q': 'Amsterdam', 'check_in_date': outbound, 'check_out_date': inbound}}
+            }
+        ])
+
+    @staticmethod
+    def _dates(query, round_):
+        # Imported here: agents reads its settings at import time, after run.py has set them.
+        from agents.prefetch import parse_dates
+
+        outbound, inbound = parse_dates(query if isinstance(query, str) else '')
+        outbound = datetime.date.fromisoformat(outbound or '2025-10-01') + datetime.timedelta(days=round_)
+        inbound = datetime.date.fromisoformat(inbound) + datetime.timedelta(days=round_) if inbound else outbound + datetime.timedelta(days=6)
+        return outbound.isoformat(), inbound.isoformat()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+
+class StubSerpApiServer:
+    '''Local HTTP server answering /search.json with recorded Google Flights/Hotels payloads.'''
+
+    def __init__(self, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._payloads = {
+            engine: json.dumps(load_fixture(engine)).encode()
+            for engine in ('google_flights', 'google_hotels')
+        }
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                query = parse_qs(urlparse(self.path).query)
+                body = stub._payloads.get(query.get('engine', [''])[0])
+                time.sleep(stub.latency)
+                status = 200
+                if body is None:
+                    status, body = 400, json.dumps({'error': 'Unsupported engine'}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-serpapi', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StubEmailSender:
+    '''Replacement for MailerSend delivery that only counts messages.'''
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+
+    def __call__(self, mail_body: dict):
+        time.sleep(self.latency)
+        self.sent += 1
+        return '202\n'
@@ -0,0 +1,39 @@
+import json
+
+from langchain_core.messages import AIMessage
+
+from agents import batch
+
+
+class FakeGraph:
+    def __init__(self, email_error=None):
+        self.email_error = email_error
+
+    def invoke(self, state, config):
+        if state is None:
+            # Resuming the run for email_sender.
+            raise self.email_error
+        return {'messages': [AIMessage(content='A week in Lisbon')], 'budget': {}}
+
+
+class FakeAgent:
+    def __init__(self, graph):
+        self.graph = graph
+        self._email_queue = self
+
+    def join(self):
+        pass
+
+
+def test_plan_is_kept_when_only_the_email_fails(tmp_path):
+    queries = tmp_path / 'queries.jsonl'
+    queries.write_text(json.dumps({'id': 'lisbon', 'query': 'A week in Lisbon'}) + '\n')
+    output = tmp_path / 'plans.jsonl'
+    agent = FakeAgent(FakeGraph(email_error=RuntimeError('MailerSend is down')))
+
+    counts = batch.run(str(queries), str(output), workers=1, send_email=True, agent=agent)
+
+    assert counts['ok'] == 1 and counts['error'] == 0
+    result = json.loads(output.read_text())
+    assert result['plan'] == 'A week in Lisbon'
+    assert result['email_error'] == 'RuntimeError: MailerSend is down'
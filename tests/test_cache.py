@@ -0,0 +1,23 @@
+from agents.cache import TTLCache, make_key
+
+
+def test_make_key_folds_case_of_codes():
+    assert make_key({'departure_id': 'ams ', 'currency': 'usd', 'adults': 1}) == \
+        make_key({'departure_id': 'AMS', 'currency': 'USD', 'adults': '1'})
+
+
+def test_make_key_keeps_tokens_verbatim():
+    params = {'engine': 'google_hotels', 'q': 'Amsterdam'}
+    assert make_key({**params, 'next_page_token': 'CBI='}) != make_key({**params, 'next_page_token': 'cbi='})
+    assert make_key({'booking_token': 'WyJDa'}) != make_key({'booking_token': 'wyjda'})
+
+
+def test_make_key_drops_api_key_and_none():
+    assert make_key({'q': 'Paris', 'api_key': 'secret', 'children': None}) == make_key({'q': 'Paris'})
+
+
+def test_cache_get_set():
+    cache = TTLCache('test', maxsize=2)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
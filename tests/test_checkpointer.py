@@ -0,0 +1,94 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from agents import db
+from agents.checkpointer import DeltaSqliteSaver
+
+PAYLOAD = '{"hotels": [' + ', '.join(f'{{"name": "Hotel {i}"}}' for i in range(200)) + ']}'
+
+
+def _graph(saver):
+    def search(state):
+        return {'messages': [AIMessage(content=PAYLOAD)]}
+
+    def answer(state):
+        return {'messages': [AIMessage(content=f'Plan from {len(state["messages"])} messages')]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node('search', search)
+    builder.add_node('answer', answer)
+    builder.add_edge(START, 'search')
+    builder.add_edge('search', 'answer')
+    builder.add_edge('answer', END)
+    # Stop before the answer, like the agent does before sending an email.
+    return builder.compile(checkpointer=saver, interrupt_before=['answer'])
+
+
+def _saver(tmp_path, **kwargs):
+    return DeltaSqliteSaver(db.connect(str(tmp_path / 'checkpoints.sqlite')), prune_interval=3600, **kwargs)
+
+
+def _count(saver, table):
+    with saver.cursor(transaction=False) as cur:
+        return cur.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_round_trip_and_resume(tmp_path):
+    saver = _saver(tmp_path)
+    graph = _graph(saver)
+    config = {'configurable': {'thread_id': 'trip-1'}}
+    graph.invoke({'messages': [HumanMessage(content='Lisbon in May')]}, config)
+
+    # A fresh saver on the same file has nothing cached, so the state comes from the tables.
+    graph = _graph(_saver(tmp_path))
+    state = graph.get_state(config)
+    assert state.next == ('answer',)
+    assert [m.content for m in state.values['messages']] == ['Lisbon in May', PAYLOAD]
+
+    final = graph.invoke(None, config)
+    assert [m.content for m in final['messages']] == ['Lisbon in May', PAYLOAD, 'Plan from 2 messages']
+    # The payload is stored once, however many checkpoints carry it.
+    assert _count(saver, 'checkpoint_payloads') == 1
+
+
+def test_prune_keeps_shared_payloads_until_unused(tmp_path):
+    saver = _saver(tmp_path, max_threads=1)
+    graph = _graph(saver)
+    for thread_id in ('trip-1', 'trip-2'):
+        graph.invoke({'messages': [HumanMessage(content=thread_id)]}, {'configurable': {'thread_id': thread_id}})
+
+    assert saver.prune() == 1
+    assert graph.get_state({'configurable': {'thread_id': 'trip-1'}}).values == {}
+    messages = graph.get_state({'configurable': {'thread_id': 'trip-2'}}).values['messages']
+    assert [m.content for m in messages] == ['trip-2', PAYLOAD]
+
+    saver.ttl = -1
+    assert saver.prune() == 1
+    assert [_count(saver, t) for t in ('checkpoint_blobs', 'checkpoint_payloads', 'checkpoint_blob_refs')] == [0, 0, 0]
+
+
+def test_missing_payload_raises(tmp_path):
+    saver = _saver(tmp_path)
+    graph = _graph(saver)
+    config = {'configurable': {'thread_id': 'trip-1'}}
+    graph.invoke({'messages': [HumanMessage(content='Lisbon in May')]}, config)
+    with saver.cursor() as cur:
+        cur.execute('DELETE FROM checkpoint_payloads')
+    with pytest.raises(KeyError):
+        graph.get_state(config)
+
+
+def test_store_after_another_process_pruned_the_thread(tmp_path):
+    saver = _saver(tmp_path)
+    messages = [HumanMessage(content='Lisbon in May'), AIMessage(content=PAYLOAD)]
+    refs = saver._store('trip-1', messages, replace=True)
+    with saver.cursor() as cur:
+        cur.execute('INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, 0)', ('trip-1',))
+    # Another process prunes the thread while this one still remembers its messages.
+    assert _saver(tmp_path, ttl=-1).prune() == 1
+
+    assert saver._store('trip-1', messages, replace=True) == refs
+    assert _count(saver, 'checkpoint_blob_refs') == 2
+    loaded = saver._load({r['__blob__'] for r in refs})
+    assert sorted(m.content for m in loaded.values()) == sorted(m.content for m in messages)
@@ -0,0 +1,35 @@
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+
+from agents.context import compact
+
+
+def _turn(n: int, rounds: int, answer: bool = True) -> list:
+    hotels = [{'name': f'Hotel {i}', 'link': f'https://example.com/{n}/{i}', 'description': 'x' * 200} for i in range(10)]
+    messages = [HumanMessage(content=f'Trip {n}', id=f'h{n}')]
+    for r in range(rounds):
+        call_id = f'call_{n}_{r}'
+        messages += [
+            AIMessage(content='', id=f'a{n}_{r}', tool_calls=[{'name': 'hotels_finder', 'args': {}, 'id': call_id}]),
+            ToolMessage(content=json.dumps({'hotels': hotels}), tool_call_id=call_id, name='hotels_finder', id=f't{n}_{r}')
+        ]
+    if answer:
+        messages.append(AIMessage(content=f'Plan {n}', id=f'p{n}'))
+    return messages
+
+
+def test_fits_without_changes():
+    assert compact(_turn(1, 1), max_tokens=100000) == ([], '')
+
+
+def test_current_turn_is_kept_verbatim():
+    messages = _turn(1, 2) + _turn(2, 2) + _turn(3, 3, answer=False)
+    updates, summary = compact(messages, max_tokens=1000, keep_turns=2)
+    removed = {m.id for m in updates if isinstance(m, RemoveMessage)}
+    changed = {m.id for m in updates if not isinstance(m, RemoveMessage)}
+    current = {m.id for m in _turn(3, 3, answer=False)}
+    assert not (removed | changed) & current
+    # Older turns, the kept previous one included, went into the summary.
+    assert {'h1', 'h2'} <= removed
+    assert summary.count('- User: Trip') == 2
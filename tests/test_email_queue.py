@@ -0,0 +1,24 @@
+from agents.email_queue import EmailDeliveryError, EmailQueue
+from agents.metrics import METRICS
+
+
+def test_outcomes_are_reported_to_metrics():
+    events = []
+    METRICS.add_sink(events.append)
+
+    def send(mail_body):
+        if mail_body['to'] == 'bad':
+            raise EmailDeliveryError('422 invalid recipient')
+        return '202'
+
+    try:
+        email_queue = EmailQueue(send=send, backoff=0)
+        email_queue.submit({'to': 'traveler@example.com'})
+        email_queue.submit({'to': 'bad'})
+        assert email_queue.join(timeout=5)
+    finally:
+        METRICS.remove_sink(events.append)
+    emails = [event for event in events if event['kind'] == 'email']
+    assert len(emails) == 2
+    assert sorted(bool(event.get('error')) for event in emails) == [False, True]
+    assert all(event['attempts'] == 1 and event['duration'] >= 0 for event in emails)
@@ -0,0 +1,35 @@
+from agents.tools import hotels_finder, serpapi_client
+from agents.tools.hotels_finder import HotelsInput, _PageStore
+
+
+def test_page_store_is_bounded_by_bytes():
+    store = _PageStore(ttl=60, max_bytes=100)
+    store.set('a', {'hotels': ['x' * 30]})
+    store.set('b', {'hotels': ['y' * 30]})
+    assert store.get('a') is not None
+    # Over the cap: the least recently used page goes first.
+    store.set('c', {'hotels': ['z' * 30]})
+    assert store.get('b') is None and store.get('a') is not None and store.get('c') is not None
+    store.set('big', {'hotels': ['w' * 200]})
+    assert store.get('big') is None
+
+
+def test_follow_up_calls_do_not_search_again(monkeypatch):
+    searches = []
+
+    def search(params, cache=None):
+        searches.append(params)
+        return {'properties': [{'name': f'Hotel {i}'} for i in range(12)]}
+
+    monkeypatch.setattr(serpapi_client, 'search', search)
+    monkeypatch.setattr(hotels_finder, 'HOTEL_PAGES', _PageStore(ttl=60, max_bytes=1 << 20))
+    params = dict(q='Lisbon', check_in_date='2026-05-03', check_out_date='2026-05-10')
+    names, cursor = [], None
+    while True:
+        result = hotels_finder._find_hotels(HotelsInput(**params, cursor=cursor))
+        names += [hotel['name'] for hotel in result['hotels']]
+        cursor = result['next_cursor']
+        if cursor is None:
+            break
+    assert names == [f'Hotel {i}' for i in range(12)]
+    assert len(searches) == 1
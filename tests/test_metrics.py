@@ -0,0 +1,25 @@
+from agents.metrics import InMemorySink, Instrumentation, current_thread_id
+
+
+def test_cache_hits_and_misses_are_counted():
+    metrics = Instrumentation()
+    token = current_thread_id.set('thread-1')
+    try:
+        metrics.emit('cache', 'gpt-4o', hit=True)
+        metrics.emit('cache', 'gpt-4o', hit=True)
+        metrics.emit('cache', 'gpt-4o', hit=False)
+    finally:
+        current_thread_id.reset(token)
+    counters = metrics.memory.snapshot()['counters']
+    assert counters['cache:gpt-4o:hit'] == 2
+    assert counters['cache:gpt-4o:miss'] == 1
+    assert metrics.memory.thread('thread-1')['cache_hits'] == 2
+    prometheus = metrics.memory.render_prometheus()
+    assert 'agent_cache_hits_total{kind="cache",name="gpt-4o"} 2' in prometheus
+    assert 'agent_cache_misses_total{kind="cache",name="gpt-4o"} 1' in prometheus
+
+
+def test_other_events_do_not_count_as_cache_misses():
+    sink = InMemorySink()
+    sink({'kind': 'llm', 'name': 'gpt-4o', 'thread_id': None, 'duration': 0.1})
+    assert sink.snapshot()['counters'] == {}
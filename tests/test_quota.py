@@ -0,0 +1,33 @@
+import threading
+
+import pytest
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+from agents.quota import Quota, QuotaExceeded
+
+
+def test_track_counts_refusals_of_its_own_run_only():
+    quota = Quota({'serpapi': 1})
+    quota.consume('serpapi')
+    results = {}
+
+    def refused_run():
+        with quota.track() as refused:
+            # Tool calls run on an executor thread, like ToolNode does.
+            with ContextThreadPoolExecutor(max_workers=1) as pool:
+                with pytest.raises(QuotaExceeded):
+                    pool.submit(quota.consume, 'serpapi').result()
+        results['refused'] = list(refused)
+
+    def clean_run():
+        with quota.track() as refused:
+            quota.consume('openai')
+        results['clean'] = list(refused)
+
+    threads = [threading.Thread(target=refused_run), threading.Thread(target=clean_run)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {'refused': ['serpapi'], 'clean': []}
+    assert quota.rejections() == 1
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import time
+
+from agents.ratelimit import AIMDLimiter, RateLimiter, SqliteTokenBucket
+
+
+def test_async_waiter_is_woken_by_release_from_another_thread():
+    limiter = AIMDLimiter(1)
+    assert limiter.acquire(0)
+
+    async def wait_for_slot():
+        started = time.monotonic()
+        acquired = await limiter.aacquire(5)
+        return acquired, time.monotonic() - started
+
+    threading.Timer(0.1, limiter.release).start()
+    acquired, waited = asyncio.run(wait_for_slot())
+    assert acquired and waited < 1
+    assert limiter.in_flight == 1
+
+
+def test_async_acquire_times_out():
+    limiter = AIMDLimiter(1)
+    assert limiter.acquire(0)
+    assert asyncio.run(limiter.aacquire(0.05)) is False
+    assert limiter._waiters == []
+
+
+def test_sqlite_bucket_is_reserved_off_the_event_loop(tmp_path):
+    limiter = RateLimiter('test', rate=0, burst=1, max_concurrency=2, path=str(tmp_path / 'rates.sqlite'))
+    assert isinstance(limiter.bucket, SqliteTokenBucket)
+    loop_threads = set()
+    reserved_on = []
+    reserve = limiter.bucket.reserve
+
+    def record_reserve():
+        reserved_on.append(threading.get_ident())
+        return reserve()
+
+    limiter.bucket.reserve = record_reserve
+
+    async def request():
+        loop_threads.add(threading.get_ident())
+        return 'ok'
+
+    assert asyncio.run(limiter.acall(request)) == 'ok'
+    assert reserved_on and not loop_threads & set(reserved_on)
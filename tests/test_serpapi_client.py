@@ -0,0 +1,46 @@
+from agents.cache import TTLCache, make_key
+from agents.metrics import METRICS, current_thread_id
+from agents.tools import serpapi_client
+
+
+def _count_for(thread_id):
+    token = current_thread_id.set(thread_id)
+    try:
+        serpapi_client._count_call()
+    finally:
+        current_thread_id.reset(token)
+
+
+def test_calls_are_counted_only_while_the_run_is_active():
+    serpapi_client.begin_run('trip-1')
+    _count_for('trip-1')
+    _count_for('trip-1')
+    assert serpapi_client.take_calls('trip-1') == 2
+    _count_for('trip-1')
+    assert serpapi_client.end_run('trip-1') == 1
+
+    # A straggler finishing after the run ended, and a thread that never ran.
+    _count_for('trip-1')
+    _count_for('trip-2')
+    assert 'trip-1' not in serpapi_client._run_calls
+    assert 'trip-2' not in serpapi_client._run_calls
+
+
+def test_resume_keeps_the_count_and_a_new_run_resets_it():
+    serpapi_client.begin_run('trip-1')
+    _count_for('trip-1')
+    serpapi_client.begin_run('trip-1', resume=True)
+    assert serpapi_client.take_calls('trip-1') == 1
+    _count_for('trip-1')
+    serpapi_client.begin_run('trip-1')
+    assert serpapi_client.end_run('trip-1') == 0
+
+
+def test_search_cache_lookups_reach_the_metrics():
+    cache = TTLCache('google_flights_test', ttl=60, maxsize=8)
+    params = {'engine': 'google_flights', 'departure_id': 'LIS', 'arrival_id': 'AMS'}
+    cache.set(make_key(params), {'best_flights': []})
+
+    assert serpapi_client.search(params, cache=cache) == {'best_flights': []}
+    counters = METRICS.memory.snapshot()['counters']
+    assert counters['cache:google_flights_test:hit'] == 1
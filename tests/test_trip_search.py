@@ -0,0 +1,35 @@
+from agents.tools import trip_search
+from agents.tools.trip_search import TripSearchInput, date_pairs, plan_searches
+
+
+def _params(**overrides) -> TripSearchInput:
+    params = {
+        'departure_airports': ['MAD'], 'arrival_airports': ['AMS'], 'earliest_outbound_date': '2026-11-01',
+        'latest_outbound_date': '2026-11-10', 'min_nights': 3, 'max_nights': 5, 'hotel_location': 'Amsterdam'
+    }
+    return TripSearchInput(**{**params, **overrides})
+
+
+def test_date_pairs_are_thinned_evenly():
+    pairs = date_pairs(_params(), 4)
+    assert len(pairs) == 4
+    assert pairs[0] == ('2026-11-01', '2026-11-04') and pairs[-1] == ('2026-11-10', '2026-11-15')
+
+
+def test_plan_searches_respects_cap():
+    searches = plan_searches(_params())
+    assert len(searches) <= trip_search.TRIP_SEARCH_MAX_SEARCHES
+    assert {s['kind'] for s in searches} == {'flights', 'hotels'}
+
+
+def test_plan_searches_with_more_routes_than_cap(monkeypatch):
+    monkeypatch.setattr(trip_search, 'TRIP_SEARCH_MAX_SEARCHES', 4)
+    params = _params(departure_airports=['LHR', 'LGW', 'STN', 'LTN'], arrival_airports=['AMS', 'RTM'])
+    searches = plan_searches(params)
+    assert len(searches) == 4
+    assert [s['kind'] for s in searches] == ['flights'] * 3 + ['hotels']
+    assert len(plan_searches(params, limit=2)) == 2
+
+
+def test_plan_searches_skips_same_airport():
+    assert plan_searches(_params(departure_airports=['AMS'], hotel_location=None)) == []